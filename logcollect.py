@@ -41,10 +41,20 @@
 # 2. It is a python module.
 
 import os
+import re
+import subprocess
 import zipfile
 import glob
 import sys
 import time
+import functools
+import threading
+
+# The next couple are used by the native probes
+import fcntl
+import pwd
+import socket
+import struct
 
 # The next couple are used by LogSend
 import http.client
@@ -53,11 +63,116 @@ import urllib.parse
 
 MFG_DATA_PATHS = ['/ofw/mfg-data/', '/proc/device-tree/mfg-data/']
 
+# Seconds a command run for laptop_info() may take; top -bn2 samples
+# twice, three seconds apart.
+PROBE_TIMEOUT = 10
+TOP_TIMEOUT = 15
+
+# The commands MachineProperties reads from /proc and /sys instead of
+# running, for comparing them with benchmark().
+NATIVE_COMMANDS = [
+    ('ifconfig', '/sbin/ifconfig'),
+    ('route_n', '/sbin/route -n'),
+    ('df_a', '/bin/df -a'),
+    ('ps_auxfwww', '/bin/ps auxfwww'),
+    ('usr_bin_free', '/usr/bin/free'),
+]
+
+_IFF_UP = 0x1
+_IFF_BROADCAST = 0x2
+_IFF_RUNNING = 0x40
+_IFF_NAMES = [
+    (0x1, 'UP'), (0x2, 'BROADCAST'), (0x4, 'DEBUG'), (0x8, 'LOOPBACK'),
+    (0x10, 'POINTOPOINT'), (0x20, 'NOTRAILERS'), (0x40, 'RUNNING'),
+    (0x80, 'NOARP'), (0x100, 'PROMISC'), (0x200, 'ALLMULTI'),
+    (0x400, 'MASTER'), (0x800, 'SLAVE'), (0x1000, 'MULTICAST'),
+    (0x2000, 'PORTSEL'), (0x4000, 'AUTOMEDIA'), (0x8000, 'DYNAMIC'),
+]
+_SCOPES = {0x0: 'global', 0x10: 'host', 0x20: 'link', 0x40: 'site',
+           0x80: 'compat'}
+_RTF_NAMES = [
+    (0x1, 'U'), (0x2, 'G'), (0x4, 'H'), (0x8, 'R'), (0x10, 'D'),
+    (0x20, 'M'), (0x200, '!'),
+]
+_SIOCGIFADDR = 0x8915
+_SIOCGIFBRDADDR = 0x8919
+_SIOCGIFNETMASK = 0x891b
+
+# Log files are copied into the archive TAIL_CHUNK bytes at a time.
+TAIL_CHUNK = 64 * 1024
+
+# Members smaller than STORE_SIZE bytes, or that already are
+# compressed, are stored rather than deflated.
+STORE_SIZE = 512
+_COMPRESSED_MAGIC = [b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00', b'PK\x03\x04',
+                     b'\x28\xb5\x2f\xfd']
+
+# Seconds values that change, like the load average, are kept for.
+DYNAMIC_TTL = 5
+
+
+def _cached(ttl=None):
+    """Keep what a MachineProperties method returns for its arguments,
+    for ttl seconds, or for good without a ttl."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args):
+            key = (method.__name__,) + args
+            now = time.time()
+            entry = self._cache.get(key)
+            if entry is not None and (ttl is None or now < entry[1] + ttl):
+                return entry[0]
+            value = method(self, *args)
+            self._cache[key] = (value, now)
+            return value
+        return wrapper
+    return decorator
+
+
+def _tail_start(f, size, tailbytes):
+    """Return where the tail of the open file f starts"""
+
+    if tailbytes <= 0 or size <= tailbytes:
+        return 0
+
+    # Look for the end of the line the tail starts in, from the byte
+    # before it in case the tail starts a line.
+    start = size - tailbytes
+    offset = start - 1
+    f.seek(offset)
+    while offset < size - 1:
+        chunk = f.read(min(TAIL_CHUNK, size - 1 - offset))
+        if not chunk:
+            break
+        cut = chunk.find(b'\n')
+        if cut > -1:
+            return offset + cut + 1
+        offset += len(chunk)
+
+    # No line starts in the tail, keep all of it.
+    return start
+
+
+def _store(f, start, length):
+    """Return whether length bytes of the open file f, from start, are
+    better stored than deflated."""
+    if length < STORE_SIZE:
+        return True
+    f.seek(start)
+    head = f.read(8)
+    return any(head.startswith(magic) for magic in _COMPRESSED_MAGIC)
+
 
 class MachineProperties:
     """Various machine properties in easy to access chunks.
+
+    Properties that never change are read once; the others are kept
+    for DYNAMIC_TTL seconds, so that frequent reports are cheap.
     """
 
+    def __init__(self):
+        self._cache = {}
+
     def __read_file(self, filename):
         """Read the entire contents of a file and return it as a string"""
 
@@ -71,6 +186,7 @@ class MachineProperties:
 
         return data
 
+    @_cached()
     def olpc_build(self):
         """Buildnumber, from /etc/issue"""
         # Is there a better place to get the build number?
@@ -88,24 +204,28 @@ class MachineProperties:
 
         return first_line
 
+    @_cached(DYNAMIC_TTL)
     def uptime(self):
         for line in self.__read_file('/proc/uptime').splitlines():
             if line != '':
                 return line
         return ''
 
+    @_cached(DYNAMIC_TTL)
     def loadavg(self):
         for line in self.__read_file('/proc/loadavg').splitlines():
             if line != '':
                 return line
         return ''
 
+    @_cached()
     def kernel_version(self):
         for line in self.__read_file('/proc/version').splitlines():
             if line != '':
                 return line
         return ''
 
+    @_cached(DYNAMIC_TTL)
     def memfree(self):
         line = ''
 
@@ -113,23 +233,37 @@ class MachineProperties:
             if line.find('MemFree:') > -1:
                 return line[8:].strip()
 
+    def _meminfo(self):
+        """Return the /proc/meminfo values, in kB"""
+        mem = {}
+        for line in self.__read_file('/proc/meminfo').splitlines():
+            name, sep, value = line.partition(':')
+            if sep:
+                mem[name] = int(value.split()[0])
+        return mem
+
     def _trim_null(self, v):
         if v != '' and ord(v[len(v) - 1]) == 0:
             v = v[:len(v) - 1]
         return v
 
+    @_cached()
+    def _mfg_dir(self):
+        """Return the mfg-data directory, or None"""
+        for test_path in MFG_DATA_PATHS:
+            if os.path.isdir(test_path):
+                return test_path
+        return None
+
+    @_cached()
     def _mfg_data(self, item):
         """Return mfg data item from mfg-data directory"""
 
-        mfg_path = None
-        for test_path in MFG_DATA_PATHS:
-            if os.path.exists(test_path + item):
-                mfg_path = test_path + item
-                break
-        if mfg_path is None:
+        mfg_dir = self._mfg_dir()
+        if mfg_dir is None or not os.path.exists(mfg_dir + item):
             return ''
 
-        v = self._trim_null(self.__read_file(mfg_path))
+        v = self._trim_null(self.__read_file(mfg_dir + item))
         return v
 
     def laptop_serial_number(self):
@@ -143,7 +277,7 @@ class MachineProperties:
         if s == '':
             return ''
 
-        return '%02X' % ord(self._mfg_data('SG')[0:1])
+        return '%02X' % ord(s)
 
     def laptop_uuid(self):
         return self._mfg_data('U#')
@@ -157,6 +291,7 @@ class MachineProperties:
     def laptop_wireless_mac(self):
         return self._mfg_data('WM')
 
+    @_cached()
     def laptop_bios_version(self):
         try:
             d = open('/proc/device-tree/openprom/model', 'r').read()
@@ -197,10 +332,12 @@ class MachineProperties:
     def battery_serial_number(self):
         return self._battery_info('serial_number')
 
+    @_cached(DYNAMIC_TTL)
     def battery_capacity(self):
         return self._battery_info('capacity') + ' ' + \
             self._battery_info('capacity_level')
 
+    @_cached(DYNAMIC_TTL)
     def battery_info(self):
         # Should be just:
         # return self._battery_info('uevent')
@@ -212,41 +349,319 @@ class MachineProperties:
 
         return bi
 
+    @_cached(DYNAMIC_TTL)
+    def _statvfs(self, path):
+        return os.statvfs(path)
+
+    @_cached()
     def disksize(self, path):
-        return os.statvfs(path).f_bsize * os.statvfs(path).f_blocks
+        st = self._statvfs(path)
+        return st.f_bsize * st.f_blocks
 
     def diskfree(self, path):
-        return os.statvfs(path).f_bsize * os.statvfs(path).f_bavail
+        st = self._statvfs(path)
+        return st.f_bsize * st.f_bavail
+
+    def _read_popen(self, cmd, timeout=None):
+        """Run cmd and return its output.
+
+        Raises subprocess.TimeoutExpired if it runs for longer than
+        timeout seconds.
+        """
+        p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE,
+                             universal_newlines=True, errors='replace')
+        try:
+            s = p.communicate(timeout=timeout)[0]
+        except subprocess.TimeoutExpired:
+            # Do not wait for it, it may be stuck on a stale mount.
+            p.kill()
+            raise
+
+        return s
+
+    def ifconfig(self):
+        """Interfaces that are up, as /sbin/ifconfig shows them"""
+        addrs6 = {}
+        if os.path.exists('/proc/net/if_inet6'):
+            for line in self.__read_file('/proc/net/if_inet6').splitlines():
+                addr, index, prefix, scope, flags, name = line.split()
+                addrs6.setdefault(name, []).append(
+                    (socket.inet_ntop(socket.AF_INET6, bytes.fromhex(addr)),
+                     int(prefix, 16), int(scope, 16)))
 
-    def _read_popen(self, cmd):
-        p = os.popen(cmd)
         s = ''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            for line in p:
-                s += line
+            lines = self.__read_file('/proc/net/dev').splitlines()[2:]
+            for line in sorted(lines, key=lambda line: line.split(':')[0]):
+                name, sep, counters = line.partition(':')
+                name = name.strip()
+                sysfs = '/sys/class/net/%s/' % name
+                flags = int(self.__read_file(sysfs + 'flags'), 16)
+                if not flags & _IFF_UP:
+                    continue
+                operstate = self.__read_file(sysfs + 'operstate').strip()
+                if operstate in ('up', 'unknown'):
+                    flags |= _IFF_RUNNING
+                s += self._interface(sock, name, sysfs, flags,
+                                     [int(n) for n in counters.split()],
+                                     addrs6.get(name, []))
         finally:
-            p.close()
+            sock.close()
 
         return s
 
-    def ifconfig(self):
-        return self._read_popen('/sbin/ifconfig')
+    def _interface(self, sock, name, sysfs, flags, counters, addrs6):
+        names = [flag for bit, flag in _IFF_NAMES if flags & bit]
+        s = '%s: flags=%d<%s>  mtu %s\n' % \
+            (name, flags, ','.join(names),
+             self.__read_file(sysfs + 'mtu').strip())
+
+        try:
+            inet = '        inet %s  netmask %s' % \
+                (self._ifaddr(sock, _SIOCGIFADDR, name),
+                 self._ifaddr(sock, _SIOCGIFNETMASK, name))
+            if flags & _IFF_BROADCAST:
+                inet += '  broadcast %s' % \
+                    self._ifaddr(sock, _SIOCGIFBRDADDR, name)
+            s += inet + '\n'
+        except OSError:
+            # No IPv4 address.
+            pass
+
+        for addr, prefix, scope in addrs6:
+            s += '        inet6 %s  prefixlen %d  scopeid 0x%x<%s>\n' % \
+                (addr, prefix, scope, _SCOPES.get(scope, 'unknown'))
+
+        queue = self.__read_file(sysfs + 'tx_queue_len').strip()
+        kind = self.__read_file(sysfs + 'type').strip()
+        if kind == '1':
+            s += '        ether %s  txqueuelen %s  (Ethernet)\n' % \
+                (self.__read_file(sysfs + 'address').strip(), queue)
+        elif kind == '772':
+            s += '        loop  txqueuelen %s  (Local Loopback)\n' % queue
+        else:
+            s += '        unspec  txqueuelen %s  (UNSPEC)\n' % queue
+
+        # /proc/net/dev counts bytes, packets, errs, drop, fifo, frame,
+        # compressed and multicast received, then bytes, packets, errs,
+        # drop, fifo, colls, carrier and compressed sent.
+        rx = counters[:8]
+        tx = counters[8:]
+        s += '        RX packets %d  bytes %d (%s)\n' % \
+            (rx[1], rx[0], self._scaled(rx[0]))
+        s += '        RX errors %d  dropped %d  overruns %d  frame %d\n' % \
+            (rx[2], rx[3], rx[4], rx[5])
+        s += '        TX packets %d  bytes %d (%s)\n' % \
+            (tx[1], tx[0], self._scaled(tx[0]))
+        s += '        TX errors %d  dropped %d overruns %d  carrier %d' \
+            '  collisions %d\n\n' % (tx[2], tx[3], tx[4], tx[6], tx[5])
+        return s
+
+    def _ifaddr(self, sock, request, name):
+        ifreq = struct.pack('256s', name.encode('utf-8')[:15])
+        result = fcntl.ioctl(sock.fileno(), request, ifreq)
+        return socket.inet_ntoa(result[20:24])
+
+    def _scaled(self, count):
+        value = float(count)
+        for unit in ['B', 'KiB', 'MiB', 'GiB']:
+            if value < 1024:
+                break
+            value /= 1024
+        else:
+            unit = 'TiB'
+        return '%.1f %s' % (value, unit)
 
     def route_n(self):
-        return self._read_popen('/sbin/route -n')
+        """The kernel IPv4 routing table, as /sbin/route -n shows it"""
+        s = 'Kernel IP routing table\n'
+        s += 'Destination     Gateway         Genmask         ' \
+             'Flags Metric Ref    Use Iface\n'
+        for line in self.__read_file('/proc/net/route').splitlines()[1:]:
+            fields = line.split()
+            if len(fields) < 8:
+                continue
+            iface, dest, gateway, flags, ref, use, metric, mask = fields[:8]
+            flags = int(flags, 16)
+            names = ''.join(flag for bit, flag in _RTF_NAMES if flags & bit)
+            s += '%-15s %-15s %-15s %-5s %-6d %-3d %6d %s\n' % \
+                (self._route_addr(dest), self._route_addr(gateway),
+                 self._route_addr(mask), names, int(metric), int(ref),
+                 int(use), iface)
+        return s
+
+    def _route_addr(self, field):
+        return socket.inet_ntoa(struct.pack('<I', int(field, 16)))
 
     def df_a(self):
-        return self._read_popen('/bin/df -a')
+        """Every mounted file system, as /bin/df -a shows it"""
+        rows = [('Filesystem', '1K-blocks', 'Used', 'Available', 'Use%',
+                 'Mounted on')]
+        for line in self.__read_file('/proc/self/mounts').splitlines():
+            fields = line.split()
+            target = re.sub(r'\\([0-7]{3})',
+                            lambda m: chr(int(m.group(1), 8)), fields[1])
+            try:
+                # Hangs on a stale network mount, as df does.
+                st = os.statvfs(target)
+            except OSError:
+                continue
+            size = st.f_blocks * st.f_frsize // 1024
+            used = size - st.f_bfree * st.f_frsize // 1024
+            avail = st.f_bavail * st.f_frsize // 1024
+            if used + avail > 0:
+                percent = '%d%%' % -(-used * 100 // (used + avail))
+            else:
+                percent = '-'
+            rows.append((fields[0], str(size), str(used), str(avail),
+                         percent, target))
+
+        widths = [max(len(row[i]) for row in rows) for i in range(5)]
+        widths[0] = max(widths[0], 14)
+        s = ''
+        for row in rows:
+            s += '%-*s %*s %*s %*s %*s %s\n' % \
+                (widths[0], row[0], widths[1], row[1], widths[2], row[2],
+                 widths[3], row[3], widths[4], row[4], row[5])
+        return s
 
     def ps_auxfwww(self):
-        return self._read_popen('/bin/ps auxfwww')
+        """Every process, as /bin/ps auxfwww shows them"""
+        hz = os.sysconf('SC_CLK_TCK')
+        page = os.sysconf('SC_PAGE_SIZE')
+        uptime = float(self.__read_file('/proc/uptime').split()[0])
+        now = time.time()
+        memtotal = self._meminfo()['MemTotal']
+
+        procs = {}
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open('/proc/%s/stat' % pid, 'rb') as f:
+                    stat = f.read().decode('utf-8', 'replace')
+                with open('/proc/%s/cmdline' % pid, 'rb') as f:
+                    cmdline = f.read().decode('utf-8', 'replace')
+                uid = os.stat('/proc/' + pid).st_uid
+            except OSError:
+                # It exited while we looked.
+                continue
+            procs[int(pid)] = (stat, cmdline, uid)
+
+        children = {}
+        for pid in sorted(procs):
+            stat = procs[pid][0]
+            ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+            if ppid not in procs:
+                ppid = 0
+            children.setdefault(ppid, []).append(pid)
+
+        s = 'USER       PID %CPU %MEM    VSZ   RSS TTY      STAT START   ' \
+            'TIME COMMAND\n'
+        stack = [(pid, 0) for pid in reversed(children.get(0, []))]
+        while stack:
+            pid, depth = stack.pop()
+            stat, cmdline, uid = procs[pid]
+            comm = stat[stat.index('(') + 1:stat.rindex(')')]
+            # fields[0] is field 3 of proc(5), the state.
+            fields = [int(n) if n.lstrip('-').isdigit() else n
+                      for n in stat[stat.rindex(')') + 2:].split()]
+            state, pgrp, session, tty, tpgid = \
+                fields[0], fields[2], fields[3], fields[4], fields[5]
+            ticks = fields[11] + fields[12]
+            nice, threads, started = fields[16], fields[17], fields[19]
+            vsize, rss = fields[20], fields[21]
+
+            if nice < 0:
+                state += '<'
+            elif nice > 0:
+                state += 'N'
+            if session == pid:
+                state += 's'
+            if threads > 1:
+                state += 'l'
+            if tpgid != -1 and tpgid == pgrp:
+                state += '+'
+
+            elapsed = uptime - float(started) / hz
+            cpu = 0.0
+            if elapsed > 0:
+                cpu = 100.0 * ticks / hz / elapsed
+            mem = 100.0 * rss * page / 1024 / memtotal
+            start = now - elapsed
+            if elapsed < 24 * 3600:
+                start = time.strftime('%H:%M', time.localtime(start))
+            else:
+                start = time.strftime('%b%d', time.localtime(start))
+            cputime = ticks // hz
+
+            command = ' '.join(cmdline.rstrip('\0').split('\0'))
+            command = re.sub('[\x00-\x1f\x7f]', '?', command)
+            if not command:
+                command = '[%s]' % comm
+            if depth:
+                command = '    ' * (depth - 1) + ' \\_ ' + command
+
+            s += '%-8s %5d %4.1f %4.1f %6d %5d %-8s %-4s %5s %3d:%02d %s\n' % \
+                (self._user(uid), pid, cpu, mem, vsize // 1024,
+                 rss * page // 1024, self._tty(tty), state, start,
+                 cputime // 60, cputime % 60, command)
+
+            for child in reversed(children.get(pid, [])):
+                stack.append((child, depth + 1))
+
+        return s
+
+    def _user(self, uid):
+        try:
+            user = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            return str(uid)
+        if len(user) > 8:
+            user = user[:7] + '+'
+        return user
+
+    def _tty(self, tty):
+        major = (tty >> 8) & 0xfff
+        minor = (tty & 0xff) | ((tty >> 12) & 0xfff00)
+        if 136 <= major <= 143:
+            return 'pts/%d' % ((major - 136) * 256 + minor)
+        if major == 4 and minor < 64:
+            return 'tty%d' % minor
+        if major == 4:
+            return 'ttyS%d' % (minor - 64)
+        return '?'
 
     def usr_bin_free(self):
-        return self._read_popen('/usr/bin/free')
+        """Memory use, as /usr/bin/free shows it"""
+        mem = self._meminfo()
+        total = mem['MemTotal']
+        free = mem['MemFree']
+        cache = mem.get('Buffers', 0) + mem.get('Cached', 0) + \
+            mem.get('SReclaimable', 0)
+        if 'MemAvailable' in mem:
+            available = mem['MemAvailable']
+            used = total - available
+        else:
+            available = free
+            used = max(total - free - cache, 0)
+
+        s = '%-8s%12s%12s%12s%12s%12s%12s\n' % \
+            ('', 'total', 'used', 'free', 'shared', 'buff/cache',
+             'available')
+        s += '%-8s%12d%12d%12d%12d%12d%12d\n' % \
+            ('Mem:', total, used, free, mem.get('Shmem', 0), cache,
+             available)
+        swap = mem.get('SwapTotal', 0)
+        swapfree = mem.get('SwapFree', 0)
+        s += '%-8s%12d%12d%12d\n' % ('Swap:', swap, swap - swapfree, swapfree)
+        return s
 
-    def top(self):
-        return self._read_popen('/usr/bin/top -bn2')
+    def top(self, timeout=None):
+        return self._read_popen('/usr/bin/top -bn2', timeout)
 
+    @_cached(DYNAMIC_TTL)
     def installed_activities(self):
         s = ''
         for path in glob.glob('/usr/share/sugar/activities/*.activity'):
@@ -266,8 +681,10 @@ class LogCollect:
 
     def __init__(self):
         self._mp = MachineProperties()
+        self.stats = []
 
-    def write_logs(self, archive='', logbytes=15360):
+    def write_logs(self, archive='', logbytes=15360, progress=None,
+                   cancel=None, compresslevel=None):
         """Write a zipfile containing the tails of the logfiles and
         machine info of the XO
 
@@ -278,6 +695,19 @@ class LogCollect:
             logbytes -  Maximum number of bytes to read from each log file.
                         0 means complete logfiles, not just the tail
                         -1 means only save machine info, no logs
+
+            progress -  Called as progress(step, steps, name) before each
+                        member of the archive is written
+
+            cancel -    A threading.Event; once it is set the capture
+                        stops, the archive is removed and None returned
+
+            compresslevel - The zlib level to deflate the logs with,
+                        0 to 9, or None for the default; tails written
+                        at a level are not dated, see write_tail()
+
+        The name, size, compressed size and seconds taken of each log
+        written are left in stats.
         """
         # This function is crammed with try...except to make sure we
         # get as much data as possible, if anything fails.
@@ -292,99 +722,152 @@ class LogCollect:
             except Exception:
                 pass
 
-        z = zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED)
+        members = []
+        if logbytes > -1:
+            members = self._log_members()
+        steps = len(members) + 1
+
+        self.stats = []
+        z = zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED,
+                            compresslevel=compresslevel)
 
         try:
+            if progress is not None:
+                progress(0, steps, 'info.txt')
             try:
                 z.writestr('info.txt', self.laptop_info())
             except Exception as e:
                 z.writestr('info.txt',
                            "logcollect: could not add info.txt: %s" % e)
 
-            if logbytes > -1:
-                # Include some log files from /var/log.
-                for fn in ['dmesg', 'messages', 'cron', 'maillog', 'rpmpkgs',
-                           'Xorg.0.log', 'spooler']:
-                    try:
-                        if os.access('/var/log/' + fn, os.F_OK):
-                            if logbytes == 0:
-                                z.write('/var/log/' + fn, 'var-log/' + fn)
-                            else:
-                                z.writestr('var-log/' + fn,
-                                           self.file_tail('/var/log/' + fn,
-                                                          logbytes))
-                    except Exception as e:
-                        z.writestr('var-log/' + fn,
-                                   "logcollect: could not add %s: %s" %
-                                   (fn, e))
-
-                home = os.path.expanduser('~')
-                here = os.path.join(home, '.sugar/default/logs/*.log')
-                for path in glob.glob(here):
-                    if os.access(path, os.F_OK):
-                        pref = 'sugar-logs/'
-                        name = os.path.join(pref, os.path.basename(path))
-                        try:
-                            if logbytes == 0:
-                                z.write(path, name)
-                            else:
-                                z.writestr(name,
-                                           self.file_tail(path, logbytes))
-                        except Exception as e:
-                            z.writestr(name,
-                                       "logcollect: could not add %s: %s" %
-                                       (name, e))
-                here = os.path.join(home, '.sugar/default/logs/*/*.log')
-                for path in glob.glob(here):
-                    if os.access(path, os.F_OK):
-                        when = os.path.basename(os.path.dirname(path))
-                        pref = 'sugar-logs-%s/' % when
-                        name = os.path.join(pref, os.path.basename(path))
-                        try:
-                            if logbytes == 0:
-                                z.write(path, name)
-                            else:
-                                z.writestr(name,
-                                           self.file_tail(path, logbytes))
-                        except Exception as e:
-                            z.writestr(name,
-                                       "logcollect: could not add %s: %s" %
-                                       (name, e))
+            for step, (path, name, whole) in enumerate(members, 1):
+                if cancel is not None and cancel.is_set():
+                    break
+                if progress is not None:
+                    progress(step, steps, name)
                 try:
-                    z.write('/etc/resolv.conf')
+                    started = time.time()
+                    if whole:
+                        zinfo = self.write_tail(z, path, name, 0)
+                    else:
+                        zinfo = self.write_tail(z, path, name, logbytes)
+                    self.stats.append((name, zinfo.file_size,
+                                       zinfo.compress_size,
+                                       time.time() - started))
                 except Exception as e:
-                    z.writestr('/etc/resolv.conf',
-                               "logcollect: could not add resolv.conf: %s" % e)
+                    z.writestr(name, "logcollect: could not add %s: %s" %
+                               (name, e))
 
         except Exception as e:
             print('While creating zip archive: %s' % e)
 
         z.close()
 
+        if cancel is not None and cancel.is_set():
+            os.remove(archive)
+            return None
+
         return archive
 
+    def print_stats(self):
+        """Print the throughput of each log the last write_logs() wrote"""
+
+        for name, size, compressed, seconds in self.stats:
+            rate = size / max(seconds, 1e-6) / (1024 * 1024)
+            print('%-48s %10d -> %10d bytes %8.1f MB/s' %
+                  (name, size, compressed, rate))
+
+    def _log_members(self):
+        """Return the path, the name in the archive and whether to
+        include the whole file, for each log file to collect."""
+        members = []
+
+        # Include some log files from /var/log.
+        for fn in ['dmesg', 'messages', 'cron', 'maillog', 'rpmpkgs',
+                   'Xorg.0.log', 'spooler']:
+            if os.access('/var/log/' + fn, os.F_OK):
+                members.append(('/var/log/' + fn, 'var-log/' + fn, False))
+
+        home = os.path.expanduser('~')
+        here = os.path.join(home, '.sugar/default/logs/*.log')
+        for path in glob.glob(here):
+            if os.access(path, os.F_OK):
+                pref = 'sugar-logs/'
+                name = os.path.join(pref, os.path.basename(path))
+                members.append((path, name, False))
+        here = os.path.join(home, '.sugar/default/logs/*/*.log')
+        for path in glob.glob(here):
+            if os.access(path, os.F_OK):
+                when = os.path.basename(os.path.dirname(path))
+                pref = 'sugar-logs-%s/' % when
+                name = os.path.join(pref, os.path.basename(path))
+                members.append((path, name, False))
+
+        members.append(('/etc/resolv.conf', 'etc/resolv.conf', True))
+        return members
+
     def file_tail(self, filename, tailbytes):
-        """Read the tail (end) of the file
+        """Read the tail (end) of the file, as bytes
+
+        The tail starts at the first line that begins in the last
+        tailbytes of the file.
 
         Arguments:
             filename    The name of the file to read
             tailbytes   Number of bytes to include or 0 for entire file
         """
 
-        data = ''
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(_tail_start(f, size, tailbytes))
+            return f.read(size)
 
-        f = open(filename)
-        try:
-            fsize = os.stat(filename).st_size
+    def write_tail(self, z, filename, name, tailbytes):
+        """Write the tail of a file into the zipfile z as name
 
-            if tailbytes > 0 and fsize > tailbytes:
-                f.seek(-tailbytes, 2)
+        The tail is as file_tail() reads it, but it is copied TAIL_CHUNK
+        bytes at a time, so large logs are never held in memory.  What
+        is appended to the file while it is copied is left out.  Small
+        and already compressed tails are stored.  Returns the ZipInfo of
+        the entry.
 
-            data = f.read()
-        finally:
-            f.close()
+        zipfile only deflates at the level z was opened with entries it
+        makes itself.  So with a level, a whole file is written by
+        z.write(), which takes in what is appended to it as well, and a
+        tail is dated 1980-01-01 with mode 0600 rather than as the file.
+        """
 
-        return data
+        with open(filename, 'rb') as f:
+            st = os.fstat(f.fileno())
+            start = _tail_start(f, st.st_size, tailbytes)
+            length = st.st_size - start
+
+            if _store(f, start, length):
+                compress_type = zipfile.ZIP_STORED
+            else:
+                compress_type = z.compression
+            if compress_type == zipfile.ZIP_STORED or z.compresslevel is None:
+                zinfo = zipfile.ZipInfo(name, time.localtime(st.st_mtime)[:6])
+                zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+                zinfo.compress_type = compress_type
+                zinfo.file_size = length
+                dest = z.open(zinfo, 'w')
+            elif start == 0:
+                z.write(filename, name)
+                return z.getinfo(name)
+            else:
+                dest = z.open(name, 'w',
+                              force_zip64=length > zipfile.ZIP64_LIMIT)
+
+            f.seek(start)
+            with dest:
+                while length > 0:
+                    chunk = f.read(min(TAIL_CHUNK, length))
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    length -= len(chunk)
+        return z.getinfo(name)
 
     def make_report(self, target='stdout'):
         """Create the report
@@ -400,6 +883,53 @@ class LogCollect:
 
         print(self._mp.battery_info())
 
+    def _probe_sections(self):
+        """Return the sections of laptop_info() that probe the system.
+
+        The probes run at the same time, each for at most its own
+        timeout, and the sections are put together in order.
+        """
+        mp = self._mp
+        probes = [
+            ('/sbin/ifconfig', mp.ifconfig, PROBE_TIMEOUT),
+            ('/sbin/route -n', mp.route_n, PROBE_TIMEOUT),
+            ('Installed Activities', mp.installed_activities, PROBE_TIMEOUT),
+            ('df -a', mp.df_a, PROBE_TIMEOUT),
+            ('ps auxwww', mp.ps_auxfwww, PROBE_TIMEOUT),
+            ('free', mp.usr_bin_free, PROBE_TIMEOUT),
+            ('top -bn2', functools.partial(mp.top, TOP_TIMEOUT), TOP_TIMEOUT),
+        ]
+
+        # Daemon threads, because a probe stuck on a stale mount can
+        # be neither killed nor waited for.
+        results = {}
+        threads = []
+        for i, (title, probe, timeout) in enumerate(probes):
+            thread = threading.Thread(target=self._run_probe,
+                                      args=(probe, results, i))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        start = time.time()
+        s = ''
+        for i, (title, probe, timeout) in enumerate(probes):
+            threads[i].join(max(0, start + timeout - time.time()))
+            data = results.get(i)
+            if data is None or isinstance(data, subprocess.TimeoutExpired):
+                data = 'logcollect: timed out after %d seconds\n' % timeout
+            elif isinstance(data, Exception):
+                data = 'logcollect: could not run: %s\n' % data
+            s += '\n[%s]\n%s\n' % (title, data)
+
+        return s
+
+    def _run_probe(self, probe, results, i):
+        try:
+            results[i] = probe()
+        except Exception as e:
+            results[i] = e
+
     def laptop_info(self):
         """Return a string with laptop serial, battery type, build,
         memory info, etc."""
@@ -408,7 +938,7 @@ class LogCollect:
         try:
             # Do not include UUID!
             s += 'laptop-info-version: 1.0\n'
-            s += 'clock: %f\n' % time.clock()
+            s += 'clock: %f\n' % time.process_time()
             s += 'date: %s\n' % time.strftime("%a, %d %b %Y %H:%M:%S +0000",
                                               time.gmtime())
             s += 'memfree: %s\n' % self._mp.memfree()
@@ -430,16 +960,7 @@ class LogCollect:
 
             s += self._mp.battery_info()
 
-            s += "\n[/sbin/ifconfig]\n%s\n" % self._mp.ifconfig()
-            s += "\n[/sbin/route -n]\n%s\n" % self._mp.route_n()
-
-            s += '\n[Installed Activities]\n%s\n' % \
-                 self._mp.installed_activities()
-
-            s += '\n[df -a]\n%s\n' % self._mp.df_a()
-            s += '\n[ps auxwww]\n%s\n' % self._mp.ps_auxfwww()
-            s += '\n[free]\n%s\n' % self._mp.usr_bin_free()
-            s += '\n[top -bn2]\n%s\n' % self._mp.top()
+            s += self._probe_sections()
         except Exception as e:
             s += '\nException while building info:\n%s\n' % e
 
@@ -526,10 +1047,31 @@ class LogSend:
         return (r == 'OK')
 
 
+def benchmark(rounds=5):
+    """Print how long the native probes take against the commands they
+    stand in for."""
+    mp = MachineProperties()
+    print('%-14s %12s %12s' % ('probe', 'native (ms)', 'command (ms)'))
+    for name, cmd in NATIVE_COMMANDS:
+        probe = getattr(mp, name)
+        start = time.time()
+        for i in range(rounds):
+            probe()
+        native = '%.2f' % ((time.time() - start) * 1000 / rounds)
+
+        start = time.time()
+        try:
+            for i in range(rounds):
+                mp._read_popen(cmd)
+            command = '%.2f' % ((time.time() - start) * 1000 / rounds)
+        except OSError:
+            command = 'missing'
+        print('%-14s %12s %12s' % (name, native, command))
+
+
 # This script is dual-mode, it can be used as a command line tool and as
 # a library.
-if sys.argv[0].endswith('logcollect.py') or \
-        sys.argv[0].endswith('logcollect'):
+if __name__ == '__main__':
     print('log-collect utility 1.0')
 
     lc = LogCollect()
@@ -557,10 +1099,17 @@ Usage:
     logcollect.py none file
                         - Just save info.txt in /dev/shm/logs-SN123.zip
 
+    logcollect.py bench
+                        - Time reading /proc against running ps, df, etc.
+
     If you specify 'all' or 'none' you must specify http or file as well.
         """)
         sys.exit()
 
+    if sys.argv[1] == 'bench':
+        benchmark()
+        sys.exit()
+
     logbytes = 15360
     if len(sys.argv) > 1:
         mode = sys.argv[len(sys.argv) - 1]
@@ -574,6 +1123,7 @@ Usage:
         logs = mode[5:]
 
     logs = lc.write_logs(logs, logbytes)
+    lc.print_stats()
     print('Logs saved in %s' % logs)
 
     sent_ok = False
@@ -0,0 +1,641 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Indexes over the bytes of a log file.  Nothing in here depends on
+# GTK, so the indexes can be built away from the main loop.
+
+import array
+import bisect
+import functools
+import os
+import pickle
+import re
+import threading
+import time
+
+# Files are indexed by trigram in blocks of _TRIGRAM_BLOCK bytes.
+_TRIGRAM_BLOCK = 64 * 1024
+
+# Levels of log lines, 0 for lines of no known level.
+DEBUG = 1
+INFO = 2
+WARNING = 3
+ERROR = 4
+CRITICAL = 5
+
+# Lines are classified by their first _HEAD_SIZE bytes, which hold the
+# level in the logging format of Sugar, '<created> <LEVEL> <name>: ...',
+# those of Python logging and GLib, or a syslog priority, '<N>...'.
+_HEAD_SIZE = 96
+_PRIORITY_RE = re.compile(rb'<(\d{1,3})>')
+_PRIORITY_LEVELS = [CRITICAL, CRITICAL, CRITICAL, ERROR, WARNING, INFO, INFO,
+                    DEBUG]
+_LEVEL_RE = re.compile(rb'\b(DEBUG|INFO|NOTICE|WARNING|WARN|ERROR|ERR|'
+                       rb'CRITICAL|CRIT|FATAL|ALERT|EMERG)\b')
+_LEVELS = {b'DEBUG': DEBUG, b'INFO': INFO, b'NOTICE': INFO,
+           b'WARNING': WARNING, b'WARN': WARNING, b'ERROR': ERROR,
+           b'ERR': ERROR, b'CRITICAL': CRITICAL, b'CRIT': CRITICAL,
+           b'FATAL': CRITICAL, b'ALERT': CRITICAL, b'EMERG': CRITICAL}
+
+
+# A time more than _OUTLIER_SKEW seconds after those of the lines on
+# either side of it is taken to be something else.
+_OUTLIER_SKEW = 24 * 3600
+
+# Lines start with a time in the format of Sugar, seconds since the
+# epoch, as an ISO date and time, as Python logging writes it, or in
+# the format of syslog, which leaves out the year.
+_TIME_RE = re.compile(
+    rb'(\d{10})(\.\d+)?\s'
+    rb'|(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)([.,]\d+)?'
+    rb'|(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +(\d{1,2}) '
+    rb'(\d\d):(\d\d):(\d\d)')
+_MONTHS = [b'Jan', b'Feb', b'Mar', b'Apr', b'May', b'Jun', b'Jul', b'Aug',
+           b'Sep', b'Oct', b'Nov', b'Dec']
+
+
+def classify(head):
+    """Return the level of a line from its first bytes, or 0."""
+    match = _PRIORITY_RE.match(head)
+    if match is not None:
+        return _PRIORITY_LEVELS[int(match.group(1)) & 7]
+    match = _LEVEL_RE.search(head)
+    if match is not None:
+        return _LEVELS[match.group(1)]
+    return 0
+
+
+@functools.lru_cache(maxsize=1024)
+def _minute_time(year, month, day, hour, minute):
+    return time.mktime((year, month, day, hour, minute, 0, 0, 0, -1))
+
+
+def parse_time(head):
+    """Return the time a line starts with, in seconds since the epoch,
+    or None."""
+    match = _TIME_RE.match(head)
+    if match is None:
+        return None
+
+    groups = match.groups()
+    if groups[0] is not None:
+        return float(groups[0] + (groups[1] or b''))
+    if groups[2] is not None:
+        year, month, day, hour, minute, second = \
+            [int(group) for group in groups[2:8]]
+        fraction = float(b'0.' + groups[8][1:]) if groups[8] else 0
+    else:
+        # Syslog leaves out the year, so a month later than this one is
+        # taken to be of last year.
+        now = time.localtime()
+        month = _MONTHS.index(groups[9]) + 1
+        year = now.tm_year - (month > now.tm_mon)
+        day, hour, minute, second = [int(group) for group in groups[10:]]
+        fraction = 0
+    return _minute_time(year, month, day, hour, minute) + second + fraction
+
+
+class LineIndex:
+    """Offsets of the starts of the lines of a log file, and the levels
+    of the lines.
+
+    The offsets are kept in an array at eight bytes a line and are
+    extended with feed() as more of the file is read.  The last entry
+    is the start of the line that has not been ended yet.  The levels
+    are kept in a bytearray alongside, and lines of no level of their
+    own, like those of a traceback, take the level of the line before.
+    The times the lines start with are kept in a TimeIndex.
+
+    An index of a later part of the file, starting at base, can be
+    built separately as a fragment and then added with extend().  The
+    first line of a fragment is the end of a line before it, so it and
+    the lines that would take its level are left at 0 until then.
+    """
+
+    def __init__(self, base=0, fragment=False):
+        self._offsets = array.array('q', [base])
+        self.levels = bytearray(1)
+        self.times = TimeIndex()
+        self.base = base
+        self.size = base
+        self._fragment = fragment
+        # The start of the last line, and of the first of a fragment,
+        # and the level of the line before the last.
+        self._head = b''
+        self._first_head = None
+        self._inherited = 0
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def clear(self):
+        self.__init__()
+
+    def extend(self, part):
+        """Add the index of the part of the file following this one."""
+        if part.base != self.size:
+            raise ValueError('index part does not follow on')
+
+        if len(part) == 1:
+            self._add_head(part._head)
+        else:
+            self._add_head(part._first_head)
+            self.times.add(len(self._offsets) - 1, parse_time(self._head))
+            self.times.extend(part.times, len(self._offsets) - 1)
+            level = self.levels[-1]
+            levels = part.levels[1:]
+            lead = len(levels) - len(levels.lstrip(b'\0'))
+            levels[:lead] = bytes([level]) * lead
+            self._offsets.extend(part._offsets[1:])
+            self.levels.extend(levels)
+            self._head = part._head
+            self._inherited = part._inherited or level
+        self.size = part.size
+
+    def feed(self, data):
+        """Index data, the next bytes of the file."""
+        offsets = self._offsets
+        levels = self.levels
+        base = self.size + 1
+        start = 0
+        found = data.find(b'\n')
+        while found > -1:
+            self._add_head(data[start:found])
+            if self._fragment and len(offsets) == 1:
+                self._first_head = self._head
+            else:
+                self.times.add(len(offsets) - 1, parse_time(self._head))
+            self._head = b''
+            self._inherited = levels[-1]
+            offsets.append(base + found)
+            levels.append(self._inherited)
+            start = found + 1
+            found = data.find(b'\n', start)
+        self._add_head(data[start:])
+        self.size += len(data)
+
+    def _add_head(self, data):
+        # Classify the last line again with more of its start.
+        if not data or len(self._head) >= _HEAD_SIZE:
+            return
+        self._head += data[:_HEAD_SIZE - len(self._head)]
+        if not self._fragment or len(self._offsets) > 1:
+            self.levels[-1] = classify(self._head) or self._inherited
+
+    def line_at(self, offset):
+        """Return the number of the line holding offset."""
+        return bisect.bisect_right(self._offsets, offset) - 1
+
+    def offset_of(self, line):
+        """Return the offset at which a line starts."""
+        return self._offsets[line]
+
+    def line_start(self, offset):
+        """Return the first line start at or after offset, or None."""
+        line = bisect.bisect_left(self._offsets, offset)
+        if line == len(self._offsets):
+            return None
+        return self._offsets[line]
+
+
+class TimeIndex:
+    """The times of the lines of a log file that start with one.
+
+    The times are kept in line order in an array, with the numbers of
+    their lines in another and the latest time up to each line in a
+    third, so lines are found by time with a binary search over the
+    latest times even where the clock goes back.  A time more than
+    _OUTLIER_SKEW seconds after those of the lines on either side, like
+    a number at the start of a line that is not a time at all, is left
+    out.  The number of lines in each minute is counted too.
+    """
+
+    def __init__(self):
+        self._times = array.array('d')
+        self._lines = array.array('q')
+        self._latest = array.array('d')
+        self._minutes = {}
+        self.first_minute = self.last_minute = None
+
+    def __len__(self):
+        return len(self._times)
+
+    def add(self, line, when):
+        """Add the time of a line, if it has one."""
+        if when is None:
+            return
+
+        self._count(int(when // 60), 1)
+        self._append(line, when)
+
+    def extend(self, part, first_line):
+        """Add the times of a part of the file starting at first_line."""
+        for minute, lines in part._minutes.items():
+            self._count(minute, lines)
+        for when, line in zip(part._times, part._lines):
+            self._append(first_line + line, when)
+
+    def _append(self, line, when):
+        if self._times and self._latest[-1] - when > _OUTLIER_SKEW and \
+                self._times[-1] == self._latest[-1] and \
+                (len(self._times) == 1 or self._latest[-2] <= when):
+            # The last time stands out from those on both sides of it.
+            self._count(int(self._times.pop() // 60), -1)
+            self._lines.pop()
+            self._latest.pop()
+        self._times.append(when)
+        self._lines.append(line)
+        self._latest.append(max(when, self._latest[-1]) if self._latest
+                            else when)
+
+    def _count(self, minute, lines):
+        count = self._minutes.get(minute, 0) + lines
+        if count:
+            self._minutes[minute] = count
+        else:
+            del self._minutes[minute]
+            if minute in (self.first_minute, self.last_minute):
+                self.first_minute = min(self._minutes, default=None)
+                self.last_minute = max(self._minutes, default=None)
+            return
+        if self.first_minute is None or minute < self.first_minute:
+            self.first_minute = minute
+        if self.last_minute is None or minute > self.last_minute:
+            self.last_minute = minute
+
+    def line_at(self, when):
+        """Return the first line at or after a time, or None."""
+        i = bisect.bisect_left(self._latest, when)
+        if i == len(self._latest):
+            return None
+        return self._lines[i]
+
+    def time_of(self, line):
+        """Return the time of a line, or of the last line before it with
+        a time, or None."""
+        i = bisect.bisect_right(self._lines, line)
+        if i == 0:
+            return None
+        return self._times[i - 1]
+
+    def histogram(self, count):
+        """Return the number of lines in each of at most count spans of
+        minutes from the first to the last, and the length of a span."""
+        if not self._minutes:
+            return [], 1
+        minutes = self.last_minute - self.first_minute + 1
+        span = -(-minutes // count)
+        buckets = [0] * -(-minutes // span)
+        for minute, lines in self._minutes.items():
+            buckets[(minute - self.first_minute) // span] += lines
+        return buckets, span
+
+
+class MatchIndex:
+    """Sorted offsets and lengths of the matches of a search in a file.
+
+    Matches are added in order as the file is searched, in arrays like
+    those of a LineIndex, and looked up by binary search.
+    """
+
+    def __init__(self):
+        self._offsets = array.array('q')
+        self._lengths = array.array('q')
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        return self._offsets[i], self._lengths[i]
+
+    def extend(self, offsets, lengths):
+        """Add matches following the others.  Matches at or before the
+        last one, found again by a search that overlaps the last, are
+        left out."""
+        skip = 0
+        if len(self._offsets):
+            skip = bisect.bisect_right(offsets, self._offsets[-1])
+        self._offsets.extend(offsets[skip:])
+        self._lengths.extend(lengths[skip:])
+
+    def index_from(self, offset):
+        """Return the index of the first match at or after offset."""
+        i = bisect.bisect_left(self._offsets, offset)
+        if i == len(self._offsets):
+            return None
+        return i
+
+    def index_before(self, offset):
+        """Return the index of the last match before offset."""
+        i = bisect.bisect_left(self._offsets, offset)
+        if i == 0:
+            return None
+        return i - 1
+
+
+class TrigramIndex:
+    """The trigrams in each block of a set of log files.
+
+    For each file the index keeps its size, modification time and inode
+    when it was indexed and, for every trigram of its bytes in lower
+    case, a mask of the blocks the trigram starts in.  A search for a
+    literal then only has to read the blocks holding all of its
+    trigrams, in the block or the one after it.  The trigrams of a file
+    are kept as a sorted array of their ids, three bytes each, with
+    their masks in an array alongside, in one item each as small as
+    holds the blocks of the file, or in as many 64 bit items as it
+    takes.
+
+    Log files are only appended to, so a file that has grown is indexed
+    from its last block on, and the blocks indexed before still apply
+    while it grows.  The files are indexed by index_blocks(), which can
+    run in worker processes, and handed to add().
+
+    The index is kept on disk at path as a snapshot of all of the files
+    followed by a record of each file added or forgotten since.  It is
+    read by load(), away from the main loop; until then it tells
+    nothing of any file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._files = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        # The bytes of the snapshot on disk and of the records after it;
+        # with no snapshot, the next record writes one.
+        self._saved = 0
+        self._appended = 0
+
+    def load(self):
+        """Read the index from disk, unless it has been already."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return
+        files = {}
+        with f:
+            try:
+                snapshot = pickle.load(f)
+            except Exception:
+                # Unreadable, start over.
+                return
+            if isinstance(snapshot, dict):
+                files = dict(
+                    (name, entry) for name, entry in snapshot.items()
+                    if isinstance(entry, tuple) and len(entry) == 5)
+                self._saved = f.tell()
+            end = os.fstat(f.fileno()).st_size
+            while self._saved and f.tell() < end:
+                try:
+                    _apply(files, *pickle.load(f))
+                except Exception:
+                    # Cut short; write a snapshot after what was read.
+                    self._saved = 0
+                    break
+                self._appended = f.tell() - self._saved
+        with self._lock:
+            self._files = files
+
+    def save(self):
+        """Write a snapshot of the whole index."""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        # Called with the lock held.
+        data = pickle.dumps(self._files, pickle.HIGHEST_PROTOCOL)
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(self.path + '.tmp', self.path)
+        self._saved = len(data)
+        self._appended = 0
+
+    def compact(self):
+        """Write a snapshot if the records after the last one have
+        grown larger than it."""
+        if self._appended > self._saved:
+            self.save()
+
+    def _append(self, *record):
+        # Called with the lock held, after applying the record.
+        if not self._saved:
+            self._save()
+            return
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        self._appended += len(data)
+
+    def prune(self, paths):
+        """Forget the files not in paths.  Returns True if any were."""
+        with self._lock:
+            gone = set(self._files) - set(paths)
+            for path in gone:
+                del self._files[path]
+                self._append(path, None, None)
+        return len(gone) > 0
+
+    def stale(self, path):
+        """Return where to index the file at path from, or None if it
+        has not changed since it was indexed."""
+        info = os.stat(path)
+        entry = self._files.get(path)
+        if entry is None:
+            return 0
+        size, mtime, inode = entry[:3]
+        if info.st_ino != inode or info.st_size < size:
+            return 0
+        if info.st_size == size and info.st_mtime == mtime:
+            return None
+        return size - size % _TRIGRAM_BLOCK
+
+    def add(self, path, offset, stamp, ids, masks):
+        """Add what index_blocks() found in the file at path from
+        offset on."""
+        entry = stamp + (ids, masks)
+        with self._lock:
+            _apply(self._files, path, offset, entry)
+            self._append(path, offset, entry)
+
+    def ranges(self, path, literal, start=0, end=None):
+        """Return the ranges of the file at path between start and end,
+        the end of the file by default, that may hold literal, or None
+        if the index can not tell."""
+        blocks = self._blocks(path, literal.lower())
+        if blocks is None:
+            return None
+        return block_ranges(path, blocks, start, end)
+
+    def candidates(self, literal):
+        """Return the blocks that may hold literal of each file the
+        index can tell about, by path, for block_ranges()."""
+        literal = literal.lower()
+        with self._lock:
+            paths = list(self._files)
+        candidates = {}
+        for path in paths:
+            blocks = self._blocks(path, literal)
+            if blocks is not None:
+                candidates[path] = blocks
+        return candidates
+
+    def _blocks(self, path, literal):
+        if not 3 <= len(literal) <= _TRIGRAM_BLOCK:
+            return None
+        entry = self._files.get(path)
+        if entry is None:
+            return None
+        size, mtime, inode, ids, masks = entry
+
+        mask = -1
+        for trigram in _trigrams_of(literal):
+            i = bisect.bisect_left(ids, trigram)
+            bits = 0
+            if i < len(ids) and ids[i] == trigram:
+                bits = _mask(masks, len(masks) // len(ids), i)
+            mask &= bits | (bits >> 1)
+            if not mask:
+                break
+        return size, mtime, inode, mask, len(literal)
+
+
+def _apply(files, path, offset, entry):
+    # Apply a record of the index to files.
+    if entry is None:
+        files.pop(path, None)
+        return
+    if offset:
+        old = files.get(path)
+        if old is None or old[2] != entry[2] or old[0] > entry[0]:
+            # Replaced or truncated since it was looked at.
+            return
+        trigrams = _unpack(*old[3:])
+        for trigram, bits in _unpack(*entry[3:]).items():
+            trigrams[trigram] = trigrams.get(trigram, 0) | bits
+        entry = entry[:3] + _pack(trigrams)
+    files[path] = entry
+
+
+def _pack(trigrams):
+    # The ids of trigrams, a dict of masks by id, in order, and their
+    # masks.
+    ids = array.array('I', sorted(trigrams))
+    blocks = max(trigrams.values(), default=0).bit_length()
+    for typecode in 'BHI':
+        masks = array.array(typecode)
+        if blocks <= masks.itemsize * 8:
+            masks.extend(trigrams[trigram] for trigram in ids)
+            return ids, masks
+    masks = array.array('Q')
+    words = range(0, blocks, masks.itemsize * 8)
+    word = (1 << masks.itemsize * 8) - 1
+    for trigram in ids:
+        bits = trigrams[trigram]
+        masks.extend((bits >> shift) & word for shift in words)
+    return ids, masks
+
+
+def _mask(masks, words, i):
+    # The mask of the i-th trigram of a file, in words items.
+    bits = 0
+    for word in reversed(masks[i * words:(i + 1) * words]):
+        bits = bits << masks.itemsize * 8 | word
+    return bits
+
+
+def _unpack(ids, masks):
+    if not ids:
+        return {}
+    words = len(masks) // len(ids)
+    if words == 1:
+        return dict(zip(ids, masks))
+    return dict((trigram, _mask(masks, words, i))
+                for i, trigram in enumerate(ids))
+
+
+def _trigrams_of(data):
+    # The ids of the trigrams of data, gathered as tuples of byte
+    # values, which is several times faster than slicing them out.
+    return [a << 16 | b << 8 | c
+            for a, b, c in set(zip(data, data[1:], data[2:]))]
+
+
+def index_blocks(path, offset=0):
+    """Return the size, modification time and inode of the file at path
+    and the ids and masks of the trigrams of its blocks from offset on,
+    for TrigramIndex.add().
+
+    Indexing all of the logs runs this in worker processes.
+    """
+    trigrams = {}
+    with open(path, 'rb') as f:
+        fd = f.fileno()
+        info = os.fstat(fd)
+        while offset < info.st_size:
+            # Read on into the next block for the trigrams that start
+            # at the end of this one.
+            data = os.pread(fd, min(_TRIGRAM_BLOCK + 2,
+                                    info.st_size - offset), offset)
+            if not data:
+                break
+            bit = 1 << (offset // _TRIGRAM_BLOCK)
+            for trigram in _trigrams_of(data.lower()):
+                trigrams[trigram] = trigrams.get(trigram, 0) | bit
+            offset += _TRIGRAM_BLOCK
+    return ((info.st_size, info.st_mtime, info.st_ino),) + _pack(trigrams)
+
+
+def block_ranges(path, blocks, start=0, end=None):
+    """Return the ranges of the file at path between start and end, the
+    end of the file by default, in blocks from TrigramIndex.candidates(),
+    or None if the file has changed since it was indexed."""
+    size, mtime, inode, mask, length = blocks
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    if info.st_ino != inode or info.st_size < size or \
+            (info.st_size == size and info.st_mtime != mtime):
+        # Replaced, truncated or rewritten since it was indexed.
+        return None
+    if end is None:
+        end = info.st_size
+
+    ranges = []
+    while mask:
+        block = (mask & -mask).bit_length() - 1
+        mask &= mask - 1
+        range_start = max(block * _TRIGRAM_BLOCK, start)
+        range_end = min((block + 1) * _TRIGRAM_BLOCK + length - 1, end)
+        if range_start >= range_end:
+            continue
+        if ranges and ranges[-1][1] >= range_start:
+            ranges[-1] = (ranges[-1][0], range_end)
+        else:
+            ranges.append((range_start, range_end))
+
+    if end > size:
+        # Matches not wholly in the indexed bytes.
+        range_start = max(size - length + 1, start)
+        if ranges and ranges[-1][1] >= range_start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((range_start, end))
+    return ranges
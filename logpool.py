@@ -0,0 +1,196 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# A pool of worker processes for work on log files.  The workers run
+# this file as their own script, so unlike those of multiprocessing
+# they never import or run the script of the process using the pool,
+# which for an activity is the Sugar launcher.
+
+import concurrent.futures
+import os
+import pickle
+import queue
+import signal
+import struct
+import subprocess
+import sys
+import threading
+
+
+class WorkerPool(concurrent.futures.Executor):
+    """An executor running functions in worker processes.
+
+    Each worker is served by a thread of its own, which hands it the
+    pickled function and arguments of a job and waits for the pickled
+    result.  The functions are pickled by name, so they have to be of a
+    module the workers can import, like logsearch or logindex.  Workers
+    are started as jobs are submitted, up to workers of them.
+    """
+
+    def __init__(self, workers=None):
+        self._workers = workers or os.cpu_count() or 1
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._processes = set()
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after '
+                                   'shutdown')
+            future = concurrent.futures.Future()
+            self._jobs.put((future, fn, args, kwargs))
+            if len(self._threads) < self._workers:
+                thread = threading.Thread(target=self._serve)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+            processes = list(self._processes)
+        if cancel_futures:
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job[0].cancel()
+        for thread in self._threads:
+            self._jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        else:
+            # The jobs still running are not waited for.
+            for process in processes:
+                process.kill()
+
+    def _serve(self):
+        process = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                data = pickle.dumps((fn, args, kwargs),
+                                    pickle.HIGHEST_PROTOCOL)
+            except Exception as err:
+                future.set_exception(err)
+                continue
+
+            if process is not None and process.poll() is not None:
+                # Gone since its last job.
+                self._stop(process)
+                process = None
+            try:
+                if process is None:
+                    process = self._start()
+                _send(process.stdin, data)
+                data = _receive(process.stdout)
+            except (OSError, EOFError):
+                future.set_exception(concurrent.futures.BrokenExecutor(
+                    'A worker process exited'))
+                self._stop(process, kill=True)
+                process = None
+                continue
+            try:
+                done, result = pickle.loads(data)
+            except Exception as err:
+                future.set_exception(err)
+                continue
+            if done:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        if process is not None:
+            self._stop(process)
+
+    def _start(self):
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        with self._lock:
+            self._processes.add(process)
+        return process
+
+    def _stop(self, process, kill=False):
+        with self._lock:
+            self._processes.discard(process)
+        if process is None:
+            return
+        if kill:
+            process.kill()
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        process.wait()
+        process.stdout.close()
+
+
+def _send(stream, data):
+    stream.write(struct.pack('=Q', len(data)) + data)
+    stream.flush()
+
+
+def _receive(stream):
+    # Each pickle is sent after its size, so one that fails to load
+    # leaves the stream where the next one starts.
+    header = stream.read(8)
+    if len(header) < 8:
+        raise EOFError
+    size, = struct.unpack('=Q', header)
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+
+def _work():
+    # Results go out on what was stdout, and whatever the jobs print
+    # goes to stderr instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    results = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    jobs = sys.stdin.buffer
+    while True:
+        try:
+            data = _receive(jobs)
+        except EOFError:
+            break
+        try:
+            fn, args, kwargs = pickle.loads(data)
+            result = (True, fn(*args, **kwargs))
+        except Exception as err:
+            result = (False, err)
+        try:
+            data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception as err:
+            data = pickle.dumps((False, RuntimeError(repr(err))))
+        _send(results, data)
+
+
+if __name__ == '__main__':
+    _work()
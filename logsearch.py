@@ -0,0 +1,132 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Searches over the bytes of log files.  The files are not decoded, so
+# matches are found at byte offsets and nothing in here depends on GTK.
+
+import array
+import os
+import re
+
+import logindex
+
+# Files are searched _SEARCH_BLOCK bytes at a time, cut back to the end
+# of the last whole line in the block.
+_SEARCH_BLOCK = 256 * 1024
+
+
+def _fold(text):
+    # Match each letter in any of its cases; re.IGNORECASE only folds
+    # ASCII letters in bytes patterns.
+    parts = []
+    for char in text:
+        forms = sorted({char, char.lower(), char.upper()})
+        if len(forms) == 1:
+            parts.append(re.escape(char.encode('utf-8')))
+        else:
+            parts.append(b'(?:%s)' % b'|'.join(
+                re.escape(form.encode('utf-8')) for form in forms))
+    return b''.join(parts)
+
+
+def compile_query(text, regex=False, match_case=True):
+    """Compile a search for text into a pattern over bytes.
+
+    Without regex the text is matched literally.  Raises re.error if
+    text is not a valid regular expression.
+    """
+    flags = re.MULTILINE
+    if not match_case:
+        flags |= re.IGNORECASE
+
+    if regex:
+        query = text.encode('utf-8')
+    elif match_case or text.isascii():
+        query = re.escape(text.encode('utf-8'))
+    else:
+        query = _fold(text)
+    return re.compile(query, flags)
+
+
+def literal_of(pattern):
+    """Return the bytes a pattern from compile_query() matches, if it
+    is a literal, or None."""
+    literal = re.sub(rb'\\(.)', rb'\1', pattern.pattern, flags=re.DOTALL)
+    if re.escape(literal) != pattern.pattern:
+        return None
+    return literal
+
+
+def search_file(fd, pattern, start, end):
+    """Search an open file from start to end for pattern.
+
+    Yields the offsets and the lengths of the matches, as two arrays,
+    for each block searched.  Matches do not run across blocks, which
+    end at lines, and empty matches are left out.
+    """
+    offset = start
+    while offset < end:
+        data = os.pread(fd, min(_SEARCH_BLOCK, end - offset), offset)
+        if not data:
+            return
+        if offset + len(data) < end:
+            cut = data.rfind(b'\n')
+            if cut > -1:
+                data = data[:cut + 1]
+
+        offsets = array.array('q')
+        lengths = array.array('q')
+        for match in pattern.finditer(data):
+            if match.end() > match.start():
+                offsets.append(offset + match.start())
+                lengths.append(match.end() - match.start())
+        yield offsets, lengths
+        offset += len(data)
+
+
+def count_matches(path, pattern, blocks=None):
+    """Return the number of matches of pattern in the file at path, or
+    only in the blocks of it from TrigramIndex.candidates().
+
+    Searches across all of the logs run this in worker processes.
+    """
+    ranges = None
+    if blocks is not None:
+        ranges = logindex.block_ranges(path, blocks)
+    with open(path, 'rb') as f:
+        fd = f.fileno()
+        if ranges is None:
+            ranges = [(0, os.fstat(fd).st_size)]
+        count = 0
+        for start, end in ranges:
+            for offsets, lengths in search_file(fd, pattern, start, end):
+                count += len(offsets)
+    return count
+
+
+def count_directory(directory, pattern, candidates):
+    """Return the number of matches of pattern in each file in
+    directory, by path.  candidates holds the blocks to search of the
+    files the index can tell about."""
+    counts = {}
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            counts[path] = count_matches(path, pattern,
+                                         candidates.get(path))
+        except OSError:
+            pass
+    return counts
@@ -16,9 +16,17 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import os
+import stat
 import time
+import codecs
 import logging
+import queue
+import threading
+import functools
+import heapq
+import concurrent.futures
 from gettext import gettext as _
+from gettext import ngettext
 
 import re
 
@@ -41,13 +49,79 @@ from sugar3.graphics.toggletoolbutton import ToggleToolButton
 from sugar3.graphics.palette import Palette
 from sugar3.graphics.alert import NotifyAlert
 from logcollect import LogCollect
+from logindex import LineIndex, MatchIndex, TrigramIndex
+import logindex
+import logpool
+import logsearch
 from sugar3.graphics.toolbarbox import ToolbarBox
 from sugar3.graphics.toolbarbox import ToolbarButton
 from sugar3.activity.widgets import CopyButton, StopButton
 from sugar3.datastore import datastore
 
 
-_AUTOSEARCH_TIMEOUT = 1000
+_AUTOSEARCH_TIMEOUT = 200
+
+# Large logs are only partly loaded; a LogBuffer holds at most
+# _WINDOW_SIZE bytes of its file and pages in _PAGE_SIZE bytes at a
+# time when the view is scrolled to either end of the window.
+_WINDOW_SIZE = 4 * 1024 * 1024
+_PAGE_SIZE = 256 * 1024
+
+# Search matches are highlighted in the visible lines and this many
+# lines around them.
+_HILITE_MARGIN = 100
+
+# Files are read by a thread in _CHUNK_SIZE pieces, at most
+# _QUEUED_CHUNKS ahead of the main loop, which spends up to
+# _FRAME_BUDGET seconds at a time adding them to the buffers.
+_CHUNK_SIZE = 64 * 1024
+_QUEUED_CHUNKS = 64
+_FRAME_BUDGET = 0.01
+
+# A file is taken to have been rewritten when the _SAMPLE_SIZE bytes
+# from the last line start known are no longer what they were.
+_SAMPLE_SIZE = 64
+
+# Changes to log files are merged and the shown log is updated at most
+# every _VISIBLE_REFRESH milliseconds, other logs every
+# _BACKGROUND_REFRESH milliseconds.
+_VISIBLE_REFRESH = 50
+_BACKGROUND_REFRESH = 1000
+
+# The files being indexed by trigram in the pool at once.
+_INDEX_JOBS = 16
+
+# The height of the histogram of lines a minute over the log.
+_HISTOGRAM_HEIGHT = 40
+
+# The backgrounds of the lines of each file in a merged view.
+_MERGE_COLORS = ['#FFF4E0', '#E6F2FF', '#EAFBE4', '#F8E6FF', '#FFFDE0',
+                 '#E4FBF8']
+
+# Columns of the tree model of log files.
+_COL_NAME = 0
+_COL_LOGFILE = 1
+_COL_PROGRESS = 2
+_COL_SUMMARY = 3
+_COL_SORT = 4
+_COL_HITS = 5
+
+_BACKGROUND_RGBA = Gdk.RGBA(1.0, 1.0, 1.0, 1)
+_HIGHLIGHT_RGBA = Gdk.RGBA(0.75, 0.75, 0.75, 1)
+
+# Log file names are parsed as xxxx-YYY.log
+_LOG_NAME_RE = re.compile(r'(.*)-(\d+)\.log$')
+
+
+def _sort_key(name):
+    """Return the key a row of the log tree is sorted by: files
+    first and then directories, by name, and xxxx-YYY.log files first
+    by xxxx and then numerically by YYY."""
+    name = name.lower()
+    match = _LOG_NAME_RE.match(name)
+    if match:
+        return (0, match.group(1), int(match.group(2)), name)
+    return (0 if name.endswith('.log') else 1, name, -1, name)
 
 
 # Should be builtin to sugar.graphics.alert.NotifyAlert...
@@ -57,7 +131,11 @@ def _notify_response_cb(notify, response, activity):
 
 class MultiLogView(Gtk.Paned):
 
-    def __init__(self, paths, extra_files):
+    __gsignals__ = {
+        'search-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+
+    def __init__(self, paths, extra_files, index_path=None):
         GObject.GObject.__init__(self)
         self.set_orientation(Gtk.Orientation.HORIZONTAL)
 
@@ -65,12 +143,64 @@ class MultiLogView(Gtk.Paned):
         self.extra_files = extra_files
         # Hold a reference to the monitors so they don't get disposed
         self._gio_monitors = []
-        self.first_file_open = '|'
+        # The row of the first log opened, and its logfile key while it
+        # is highlighted.
+        self._first_open = None
+        self._highlight_key = None
 
         self.active_log = None
+        # The view of several logs merged by time, if shown, and their
+        # logfile keys.
+        self._merged = None
+        self._merged_keys = []
+        # Every log file in the tree, as (path, tree iter), and the
+        # LogBuffers built so far for them.  A LogBuffer is only built
+        # when its file is first shown or changes.
+        self._files = {}
         self.logs = {}
-
+        # The logfile keys of the files by absolute path.
+        self._logfiles = {}
+        # The rows of the session directories, and those not yet
+        # expanded, by name.
+        self._sessions = {}
+        self._unexpanded = {}
+
+        # Logs changed since their last update, and when that was.
+        self.visible_refresh = _VISIBLE_REFRESH
+        self.background_refresh = _BACKGROUND_REFRESH
+        self._changed = set()
+        self._updated = {}
+        self._refresh_id = None
+
+        # Lines below this level are hidden.
+        self.level = 0
+
+        # The search, compiled, and the error compiling it if any.
         self.search_text = ''
+        self.search_error = None
+        self._pattern = None
+        # Whether to select the first match found by a new search, or
+        # the first match in the log.
+        self._select_pending = False
+        self._select_first = False
+
+        # Searches across all of the logs run in a pool of processes;
+        # the number of matches in each file by path, and a generation
+        # bumped when the counts in flight no longer apply.
+        self._pool = None
+        self._futures = []
+        self._hits = {}
+        self._hits_generation = 0
+
+        # With an index_path, searches of the profile logs are narrowed
+        # by a TrigramIndex kept there, read and updated by a thread.
+        self._trigrams = None
+        self._indexer = None
+        if index_path is not None:
+            self._trigrams = TrigramIndex(index_path)
+
+        self._reader = LogReader(self._log_read_cb)
+        self._searcher = LogSearcher(self._log_searched_cb, self._trigrams)
 
         self._build_treeview()
         self._build_textview()
@@ -79,35 +209,143 @@ class MultiLogView(Gtk.Paned):
 
         self._configure_watcher()
         self._find_logs()
+        self._update_trigrams()
+
+        self.connect('destroy', self._destroy_cb)
+
+    def _destroy_cb(self, widget):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = logpool.WorkerPool()
+        return self._pool
+
+    def _update_trigrams(self):
+        # Bring the index of the profile logs up to date, unless that
+        # is being done already.
+        if self._trigrams is None or \
+                (self._indexer is not None and self._indexer.is_alive()):
+            return
+
+        self._indexer = threading.Thread(target=self._index_files,
+                                         args=(self._get_pool(),))
+        self._indexer.daemon = True
+        self._indexer.start()
+
+    def _index_files(self, pool):
+        # Runs in the indexer thread; the files are read by the pool and
+        # each is saved to the index as it comes back.
+        self._trigrams.load()
+        files = []
+        for root, dirs, names in os.walk(self.paths[0]):
+            files.extend(os.path.join(root, name) for name in names)
+
+        try:
+            self._trigrams.prune(files)
+            pending = {}
+            for path in files:
+                try:
+                    offset = self._trigrams.stale(path)
+                except OSError:
+                    continue
+                if offset is None:
+                    continue
+                if len(pending) >= _INDEX_JOBS:
+                    self._add_indexed(pending)
+                future = pool.submit(logindex.index_blocks, path, offset)
+                pending[future] = (path, offset)
+            while pending:
+                self._add_indexed(pending)
+            self._trigrams.compact()
+        except RuntimeError:
+            # The pool was shut down.
+            pass
+        except OSError as err:
+            logging.debug('Unable to save the search index: %s', err)
+
+    def _add_indexed(self, pending):
+        done, not_done = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            path, offset = pending.pop(future)
+            try:
+                self._trigrams.add(path, offset, *future.result())
+            except (OSError, concurrent.futures.CancelledError):
+                pass
 
     def _format_col(self, col, cell, model, iterator, user_data):
-        treestore, text_iter = self._treeview.get_selection().get_selected()
-        direc, filename = self.first_file_open.split('|')
-        if text_iter is None:
-            if filename == model.get_value(iterator, 0):
-                parent_iter = model.iter_parent(iterator)
-                if parent_iter is None:
-                    cell.props.background_rgba = Gdk.RGBA(1.0, 1.0, 1.0, 1)
-                else:
-                    if direc == model.get_value(parent_iter, 0):
-                        cell.props.background_rgba = \
-                            Gdk.RGBA(0.75, 0.75, 0.75, 1)
-                    else:
-                        cell.props.background_rgba = Gdk.RGBA(1.0, 1.0, 1.0, 1)
-            else:
-                cell.props.background_rgba = Gdk.RGBA(1.0, 1.0, 1.0, 1)
+        if self._highlight_key is not None and \
+                model.get_value(iterator, _COL_LOGFILE) == self._highlight_key:
+            cell.props.background_rgba = _HIGHLIGHT_RGBA
         else:
-            cell.props.background_rgba = Gdk.RGBA(1.0, 1.0, 1.0, 1)
+            cell.props.background_rgba = _BACKGROUND_RGBA
+
+    def _selection_changed_cb(self, selection):
+        # Highlight the first log opened while no row is selected.
+        key = None
+        if selection.count_selected_rows() == 0 and \
+                self._first_open is not None and self._first_open.valid():
+            tree_iter = self._treemodel.get_iter(self._first_open.get_path())
+            key = self._treemodel.get_value(tree_iter, _COL_LOGFILE)
+
+        if key != self._highlight_key:
+            self._highlight_key = key
+            self._treeview.queue_draw()
+
+        self._show_selected()
+
+    def _show_selected(self):
+        # Show the selected log, or merge the logs when more than one is
+        # selected.  The cursor is left on a row deselected with Ctrl,
+        # so it is not followed.
+        model, paths = self._treeview.get_selection().get_selected_rows()
+        keys = [model.get_value(model.get_iter(path), _COL_LOGFILE)
+                for path in paths]
+        keys = [key for key in keys if key in self._files]
+        if len(keys) > 1:
+            self._show_merged(keys)
+        elif len(keys) == 1:
+            logfile = keys[0]
+            hits = self._hits.get(self._files[logfile][0], 0)
+            if self._merged is None and self.active_log is not None and \
+                    self.active_log is self.logs.get(logfile) and hits <= 0:
+                return
+            self._show_log(logfile)
+            if hits > 0:
+                # Found by a search across all of the logs.
+                self._select_first = True
+                self._select_found()
+
+    def _format_progress(self, col, cell, model, iterator, user_data):
+        # Only show progress while a log is being loaded.
+        cell.props.visible = model.get_value(iterator, _COL_PROGRESS) < 100
+
+    def _format_hits(self, col, cell, model, iterator, user_data):
+        hits = model.get_value(iterator, _COL_HITS)
+        cell.props.visible = hits > 0
+        if hits > 0:
+            cell.props.text = ngettext('%d match', '%d matches', hits) % hits
 
     def _build_treeview(self):
         self._treeview = Gtk.TreeView()
 
         self._treeview.set_rules_hint(True)
+        self._treeview.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
         self._treeview.connect('cursor-changed', self._cursor_changed_cb)
+        self._treeview.connect('test-expand-row', self._test_expand_row_cb)
+        self._treeview.get_selection().connect('changed',
+                                               self._selection_changed_cb)
         self._treeview.set_enable_search(False)
 
         self._treemodel = Gtk.TreeStore(GObject.TYPE_STRING,
-                                        GObject.TYPE_STRING)
+                                        GObject.TYPE_STRING,
+                                        GObject.TYPE_INT,
+                                        GObject.TYPE_STRING,
+                                        GObject.TYPE_PYOBJECT,
+                                        GObject.TYPE_INT)
 
         if hasattr(Gtk.TreeModelSort, 'new_with_model'):
             # GTK 3.24.14 and later
@@ -116,26 +354,40 @@ class MultiLogView(Gtk.Paned):
             # GTK 3.24.13 and earlier, gtk/e3247ed0d9
             sorted = self._treemodel.sort_new_with_model()
 
-        sorted.set_sort_column_id(0, Gtk.SortType.ASCENDING)
-        sorted.set_sort_func(0, self._sort_logfile)
+        sorted.set_sort_column_id(_COL_NAME, Gtk.SortType.ASCENDING)
+        sorted.set_sort_func(_COL_NAME, self._sort_logfile)
         self._treeview.set_model(sorted)
 
         renderer = Gtk.CellRendererText()
-        col = Gtk.TreeViewColumn(_('Log Files'), renderer, text=0)
+        col = Gtk.TreeViewColumn(_('Log Files'), renderer, text=_COL_NAME)
         col.set_cell_data_func(renderer, self._format_col, 0)
+        renderer = Gtk.CellRendererText()
+        renderer.props.foreground = '#808080'
+        renderer.props.scale = 0.8
+        col.pack_start(renderer, False)
+        col.add_attribute(renderer, 'text', _COL_SUMMARY)
+        renderer = Gtk.CellRendererText()
+        renderer.props.foreground = '#0000B0'
+        renderer.props.scale = 0.8
+        col.pack_start(renderer, False)
+        col.set_cell_data_func(renderer, self._format_hits)
+        renderer = Gtk.CellRendererProgress()
+        col.pack_end(renderer, False)
+        col.add_attribute(renderer, 'value', _COL_PROGRESS)
+        col.set_cell_data_func(renderer, self._format_progress)
         self._treeview.append_column(col)
 
         renderer = Gtk.CellRendererText()
-        col = Gtk.TreeViewColumn('', renderer, text=1)
+        col = Gtk.TreeViewColumn('', renderer, text=_COL_LOGFILE)
         self._treeview.append_column(col)
         col.props.visible = False
 
         self.path_iter = {}
         for p in self.paths:
-            self.path_iter[p] = self._treemodel.append(None, [p, ''])
+            self.path_iter[p] = self._append_row(None, p)
 
         if len(self.extra_files):
-            self.extra_iter = self._treemodel.append(None, [_('Other'), ''])
+            self.extra_iter = self._append_row(None, _('Other'))
 
         self.list_scroll = Gtk.ScrolledWindow()
         self.list_scroll.set_policy(Gtk.PolicyType.AUTOMATIC,
@@ -160,107 +412,267 @@ class MultiLogView(Gtk.Paned):
         scroll = Gtk.ScrolledWindow()
         scroll.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
         scroll.add(self._textview)
+        scroll.get_vadjustment().connect('value-changed',
+                                         self._scroll_changed_cb)
+
+        # The number of lines of the log a minute, click to jump there.
+        self._histogram = Gtk.DrawingArea()
+        self._histogram.set_size_request(-1, _HISTOGRAM_HEIGHT)
+        self._histogram.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
+        self._histogram.connect('draw', self._histogram_draw_cb)
+        self._histogram.connect('button-press-event',
+                                self._histogram_press_cb)
+
+        box = Gtk.VBox(False, 0)
+        box.pack_start(self._histogram, False, False, 0)
+        box.pack_start(scroll, True, True, 0)
+        self.add2(box)
+
+    def _histogram_draw_cb(self, widget, cr):
+        width = widget.get_allocated_width()
+        height = widget.get_allocated_height()
+        cr.set_source_rgb(1, 1, 1)
+        cr.paint()
+
+        log = self.active_log
+        if log is None:
+            return False
+        buckets, span = log.index.times.histogram(width)
+        if not buckets:
+            return False
+
+        peak = float(max(buckets))
+        bar = float(width) / len(buckets)
+        cr.set_source_rgb(0.45, 0.6, 0.8)
+        for i, count in enumerate(buckets):
+            if count:
+                bar_height = max(1.0, height * count / peak)
+                cr.rectangle(i * bar, height - bar_height, max(bar - 1, 1),
+                             bar_height)
+        cr.fill()
+        return False
+
+    def _histogram_press_cb(self, widget, event):
+        log = self.active_log
+        if log is None:
+            return False
+        times = log.index.times
+        width = widget.get_allocated_width()
+        buckets, span = times.histogram(width)
+        if not buckets:
+            return False
+
+        i = min(int(event.x * len(buckets) / width), len(buckets) - 1)
+        line = times.line_at((times.first_minute + i * span) * 60)
+        if line is not None:
+            self.jump_to_line(line)
+        return True
+
+    def jump_to_line(self, line):
+        log = self.active_log
+        if log is None:
+            return
+
+        text_iter = log.get_iter_at_file_line(line)
+        log.place_cursor(text_iter)
+        self._textview.scroll_to_iter(text_iter, 0.1, use_align=True,
+                                      xalign=0.0, yalign=0.5)
+
+    def jump_to_time(self, text):
+        """Move to the first line of the active log at or after a time
+        of day, 'HH:MM' or 'HH:MM:SS', on the day of the line at the
+        cursor.  Returns False if there is no such line."""
+        log = self.active_log
+        match = re.match(r'\s*(\d{1,2}):(\d\d)(?::(\d\d))?\s*$', text)
+        if log is None or match is None:
+            return False
+
+        times = log.index.times
+        line = log.get_file_line(log.get_iter_at_mark(log.get_insert()))
+        reference = times.time_of(line)
+        if reference is None:
+            reference = times.time_of(len(log.index))
+        if reference is None:
+            return False
 
-        self.add2(scroll)
+        day = time.localtime(reference)
+        hour, minute, second = [int(group or 0) for group in match.groups()]
+        line = times.line_at(time.mktime((day.tm_year, day.tm_mon,
+                                          day.tm_mday, hour, minute, second,
+                                          0, 0, -1)))
+        if line is None:
+            return False
+        self.jump_to_line(line)
+        return True
+
+    def _scroll_changed_cb(self, adjustment):
+        # Page more of the file in when the view reaches either end of
+        # the window held by the active LogBuffer.
+        log = self.active_log
+        if log is None or self._textview.get_buffer() != log:
+            return
+
+        value = adjustment.get_value()
+        if value <= adjustment.get_lower():
+            mark = log.create_mark(None, log.get_start_iter(), False)
+            if log.page_backward():
+                self._textview.scroll_to_mark(mark, 0, True, 0.0, 0.0)
+            log.delete_mark(mark)
+        elif value >= adjustment.get_upper() - adjustment.get_page_size():
+            mark = log.create_mark(None, log.get_end_iter(), True)
+            if log.page_forward():
+                self._textview.scroll_to_mark(mark, 0, True, 0.0, 1.0)
+            log.delete_mark(mark)
+
+        self._highlight_visible()
+
+    def _highlight_visible(self):
+        # Only the matches in and around the visible lines are tagged.
+        log = self.active_log
+        if log is None or log.pattern is None:
+            return
+
+        rect = self._textview.get_visible_rect()
+        top, y = self._textview.get_line_at_y(rect.y)
+        bottom, y = self._textview.get_line_at_y(rect.y + rect.height)
+        log.highlight_matches(
+            max(0, top.get_line() - _HILITE_MARGIN),
+            min(bottom.get_line() + _HILITE_MARGIN, log.get_line_count() - 1))
 
     def _sort_logfile(self, treemodel, itera, iterb, user_data=None):
-        a = treemodel.get_value(itera, 0)
-        b = treemodel.get_value(iterb, 0)
+        a = treemodel.get_value(itera, _COL_SORT)
+        b = treemodel.get_value(iterb, _COL_SORT)
         if a is None or b is None:
             return 0
-        a = a.lower()
-        b = b.lower()
-
-        # Filenames are parased as xxxx-YYY.log
-        # Sort first by xxxx, then numerically by YYY.
-        logre = re.compile(r'(.*)-(\d+)\.log', re.IGNORECASE)
-        ma = logre.match(a)
-        mb = logre.match(b)
-        if ma and mb:
-            if ma.group(1) > mb.group(1):
-                return 1
-            if ma.group(1) < mb.group(1):
-                return -1
-            if int(ma.group(2)) > int(mb.group(2)):
-                return 1
-            if int(ma.group(2)) < int(mb.group(2)):
-                return -1
-            return 0
-        else:
-            # Put first the files and later the directories
-            if a.endswith('.log') and not b.endswith('.log'):
-                return -1
-            if b.endswith('.log') and not a.endswith('.log'):
-                return 1
-
-            if a > b:
-                return 1
-            if a < b:
-                return -1
-            return 0
+        return (a > b) - (a < b)
+
+    def _append_row(self, parent, name, logfile='', summary=''):
+        return self._treemodel.append(
+            parent, [name, logfile, 100, summary, _sort_key(name), -1])
 
     def _configure_watcher(self):
+        # Session directories are watched once they are expanded.
         for p in self.paths:
-            for q in os.listdir(p):
-                r = os.path.join(p, q)
-                if os.path.isdir(r):
-                    self._create_gio_monitor(r)
             self._create_gio_monitor(p)
 
         for f in self.extra_files:
             self._create_gio_monitor(f)
 
-    def _create_gio_monitor(self, direc_path):
-        monitor = Gio.File.new_for_path(direc_path)\
-            .monitor_directory(Gio.FileMonitorFlags.NONE, None)
+    def _create_gio_monitor(self, path):
+        gfile = Gio.File.new_for_path(path)
+        if os.path.isdir(path):
+            monitor = gfile.monitor_directory(Gio.FileMonitorFlags.NONE, None)
+        else:
+            monitor = gfile.monitor_file(Gio.FileMonitorFlags.NONE, None)
         monitor.connect('changed', self._log_file_changed_cb)
         self._gio_monitors.append(monitor)
 
     def _log_file_changed_cb(self, monitor, log_file, other_file, event):
         filepath = log_file.get_path()
-        logfile = None
-        for p in self.paths:
-            if filepath.startswith(p):
-                logfile = os.path.relpath(filepath, p)
-                break
+        logfile = self._logfiles.get(filepath)
 
         if event == Gio.FileMonitorEvent.CHANGED:
-            if logfile in self.logs:
-                self.logs[logfile].update()
+            if logfile is not None:
+                self._changed.add(logfile)
+                if self._refresh_id is None:
+                    self._refresh_id = GLib.timeout_add(
+                        self.visible_refresh, self._refresh_cb)
         elif event == Gio.FileMonitorEvent.DELETED:
-            if logfile in self.logs:
+            if logfile is not None:
                 self._remove_log_file(logfile)
         elif event == Gio.FileMonitorEvent.CREATED:
-            self._add_log_file(log_file.get_path())
+            self._add_log_file(filepath)
+
+    def _refresh_cb(self):
+        now = time.time()
+        for logfile in list(self._changed):
+            log = self.logs.get(logfile)
+            if log is not None and log == self.active_log or \
+                    logfile in self._merged_keys:
+                interval = self.visible_refresh
+            else:
+                interval = self.background_refresh
+            if now - self._updated.get(logfile, 0) >= interval / 1000.0:
+                self._changed.discard(logfile)
+                self._updated[logfile] = now
+                if logfile in self._merged_keys:
+                    # Read by the merged view, which is not built on a
+                    # buffer of each log.
+                    self._merged.update()
+                    if log is not None:
+                        log.update()
+                else:
+                    self._get_log(logfile).update()
+
+        if self._changed:
+            return True
+        self._refresh_id = None
+        return False
 
     def _cursor_changed_cb(self, treeview):
-        selection = self._treeview.get_selection()
-        if selection is not None:
-            treestore, text_iter = selection.get_selected()
-            if text_iter is not None:
-                self._show_log(treestore.get_value(text_iter, 1))
-                if treestore.iter_has_child(text_iter):
-                    path = treestore.get_path(text_iter)
-                    if treeview.row_expanded(path):
-                        treeview.collapse_row(path)
-                    else:
-                        treeview.expand_row(path, False)
+        path, column = treeview.get_cursor()
+        if path is None:
+            return
+
+        treestore = treeview.get_model()
+        text_iter = treestore.get_iter(path)
+        self._show_selected()
+        if treestore.iter_has_child(text_iter):
+            if treeview.row_expanded(path):
+                treeview.collapse_row(path)
+            else:
+                treeview.expand_row(path, False)
+
+    def _get_log(self, logfile):
+        log = self.logs.get(logfile)
+        if log is None:
+            path, tree_iter = self._files[logfile]
+            log = LogBuffer(path, tree_iter, self._reader, self._searcher)
+            self.logs[logfile] = log
+        return log
+
+    def _show_merged(self, keys):
+        if keys == self._merged_keys:
+            return
+
+        self._close_merged()
+        self._merged = MergedBuffer(
+            [(os.path.basename(self._files[key][0]), self._files[key][0])
+             for key in keys])
+        self._merged_keys = keys
+        self._textview.set_buffer(self._merged)
+        # Searching, filtering and jumping work on single logs only.
+        self.active_log = None
+        self._histogram.queue_draw()
+        self.emit('search-changed')
+
+    def _close_merged(self):
+        if self._merged is not None:
+            self._merged.close()
+            self._merged = None
+            self._merged_keys = []
 
     def _show_log(self, logfile):
-        if logfile in self.logs:
-            if self.active_log is None:
-                try:
-                    direc, filename = os.path.split(logfile)
-                    self.first_file_open = \
-                        time.ctime(float(direc)) + '|' + filename
-                except ValueError:
-                    self.first_file_open = \
-                        env.get_profile_path('logs') + '|' + logfile
-            log = self.logs[logfile]
+        if logfile in self._files:
+            self._close_merged()
+            if self._first_open is None:
+                path, tree_iter = self._files[logfile]
+                self._first_open = Gtk.TreeRowReference.new(
+                    self._treemodel, self._treemodel.get_path(tree_iter))
+            log = self._get_log(logfile)
+            if log.level != self.level:
+                log.set_level(self.level)
+            if log.pattern != self._pattern:
+                log.set_search(self._pattern)
             self._textview.set_buffer(log)
             self._textview.scroll_to_mark(
                 log.get_insert(), 0, use_align=False, xalign=0.5, yalign=0.5)
             self.active_log = log
+            self._select_pending = False
+            self._select_first = False
+            self._highlight_visible()
+            self._histogram.queue_draw()
+            self.emit('search-changed')
 
     def _find_logs(self):
         for path in self.paths:
@@ -277,21 +689,30 @@ class MultiLogView(Gtk.Paned):
         for logfile in self.extra_files:
             self._add_log_file(logfile)
 
-        self._treeview.expand_all()
+        roots = list(self.path_iter.values())
+        if len(self.extra_files):
+            roots.append(self.extra_iter)
+        model = self._treeview.get_model()
+        for tree_iter in roots:
+            path = model.convert_child_path_to_path(
+                self._treemodel.get_path(tree_iter))
+            self._treeview.expand_row(path, False)
 
     def _add_log_file(self, path, parent=None, _dir=None):
-        if os.path.isdir(path):
+        try:
+            mode = os.stat(path).st_mode
+        except OSError:
+            logging.debug(_("ERROR: File '%(file)s' does not exist.") %
+                          {'file': path})
+            return False
+
+        if stat.S_ISDIR(mode):
             pdir, _dir = os.path.split(path)
             if pdir == self.paths[0]:
                 self._add_old_logs_dir(pdir, _dir)
 
             return False
 
-        if not os.path.exists(path):
-            logging.debug(_("ERROR: File '%(file)s' does not exist.") %
-                          {'file': path})
-            return False
-
         if not os.access(path, os.R_OK):
             logging.debug(_("ERROR: Unable to read file '%(file)s'.") %
                           {'file': path})
@@ -302,110 +723,602 @@ class MultiLogView(Gtk.Paned):
 
         if _dir:
             logfile = '%s/%s' % (_dir, logfile)
+        elif directory not in self.path_iter:
+            # Extra files may share a name with a log.
+            logfile = path
 
-        if logfile not in self.logs or _dir:
+        if logfile not in self._files or _dir:
             if not parent:
                 parent = self.extra_iter
                 if directory in self.path_iter:
                     parent = self.path_iter[directory]
-            tree_iter = self._treemodel.append(parent, [name, logfile])
-
-            model = LogBuffer(path, tree_iter)
+            tree_iter = self._append_row(parent, name, logfile)
+            if path in self._hits:
+                self._treemodel.set_value(tree_iter, _COL_HITS,
+                                          self._hits[path])
 
-            self.logs[logfile] = model
+            self._files[logfile] = (path, tree_iter)
+            self._logfiles[path] = logfile
+        elif logfile in self.logs:
+            self.logs[logfile].update()
 
-        log = self.logs[logfile]
-        log.update()
-        written = log._written
-
-        if self.active_log is None:
+        if self.active_log is None and self._merged is None:
             self._show_log(logfile)
-            self.active_log = log
             success, log_iter = \
-                self._treeview.get_model().convert_child_iter_to_iter(log.iter)
+                self._treeview.get_model().convert_child_iter_to_iter(
+                    self.active_log.iter)
             self._treeview.get_selection().select_iter(log_iter)
 
+    def _log_read_cb(self, log, written):
+        self._treemodel.set_value(log.iter, _COL_PROGRESS, log.get_progress())
+        if self.active_log == log:
+            self._histogram.queue_draw()
+
         if written > 0 and self.active_log == log:
             self._textview.scroll_to_mark(
                 log.get_insert(), 0, use_align=False, xalign=0.5, yalign=0.5)
+            self._highlight_visible()
+
+    def _log_searched_cb(self, log, written):
+        if log != self.active_log:
+            return
+
+        self._select_found()
+        self._highlight_visible()
+        self.emit('search-changed')
+
+    def _select_found(self):
+        # Select the match waited for once it is found: the first in
+        # the log, or else the first at or after the cursor, or the
+        # last before it once the search ends.
+        log = self.active_log
+        if self._select_first:
+            if len(log.matches):
+                self._select_first = False
+                self._select_match(0)
+            elif not log.searching:
+                self._select_first = False
+        elif self._select_pending:
+            if self.get_next_result('current') is not None:
+                self._select_pending = False
+                self.search_next('current')
+            elif not log.searching:
+                self._select_pending = False
+                self.search_next('backward')
 
     def _add_old_logs_dir(self, path, _dir):
-        # Add a directory with their respective logs
+        # Add a directory with a placeholder for its logs, which are
+        # only added when it is expanded.
         complete = os.path.join(path, _dir)
         name = time.ctime(float(_dir))
-        parent = self._treemodel.append(self.path_iter[path], [name, ''])
+
+        count = size = 0
+        try:
+            with os.scandir(complete) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        count += 1
+                        size += entry.stat().st_size
+        except OSError:
+            pass
+        summary = ngettext('%d file', '%d files', count) % count
+        summary += ', ' + GLib.format_size(size)
+
+        parent = self._append_row(self.path_iter[path], name, _dir, summary)
+        self._append_row(parent, '')
+        self._sessions[_dir] = parent
+        self._unexpanded[_dir] = complete
+
+        return parent
+
+    def _test_expand_row_cb(self, treeview, tree_iter, path):
+        model = treeview.get_model()
+        _dir = model.get_value(tree_iter, _COL_LOGFILE)
+        if _dir not in self._unexpanded:
+            return False
+
+        complete = self._unexpanded.pop(_dir)
+        parent = model.convert_iter_to_child_iter(tree_iter)
+        self._treemodel.remove(self._treemodel.iter_children(parent))
         for p in os.listdir(complete):
             self._add_log_file(os.path.join(complete, p), parent, _dir)
+        self._create_gio_monitor(complete)
 
-        return parent
+        return False
 
     def _remove_log_file(self, logfile):
-        log = self.logs[logfile]
-        self._treemodel.remove(log.iter)
-        if self.active_log == log:
-            self.active_log = None
-        del self.logs[logfile]
-
-    def set_search_text(self, text):
+        self._changed.discard(logfile)
+        self._updated.pop(logfile, None)
+        path, tree_iter = self._files.pop(logfile)
+        del self._logfiles[path]
+        self._treemodel.remove(tree_iter)
+        log = self.logs.pop(logfile, None)
+        if log is not None:
+            log.close()
+            if self.active_log == log:
+                self.active_log = None
+
+    def set_level(self, level):
+        """Show only the lines of level and above, from the levels of
+        logindex, or every line if level is 0."""
+        self.level = level
+        if self.active_log is not None:
+            self.active_log.set_level(level)
+            self._highlight_visible()
+
+    def set_search_text(self, text, regex=False, match_case=True,
+                        all_logs=False):
+        """Search the active log for text, as a regular expression if
+        regex is set.  The matches are found in the background and the
+        'search-changed' signal is emitted as they come in.  With
+        all_logs, the matches in every log are counted too."""
         self.search_text = text
+        self.search_error = None
+        self._pattern = None
+        if text:
+            try:
+                self._pattern = logsearch.compile_query(text, regex,
+                                                        match_case)
+            except re.error as err:
+                self.search_error = str(err)
+
+        self._search_all(self._pattern if all_logs else None)
+
+        log = self.active_log
+        if log is None:
+            return
+
+        start, end = log.get_bounds()
+        log.remove_tag_by_name('search-select', start, end)
+        log.set_search(self._pattern)
+        self._select_pending = self._pattern is not None
+
+    def _search_all(self, pattern):
+        # Count the matches of pattern in every log in the tree, or in
+        # the session directories, in the pool.
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+        self._clear_hits()
+        self._hits = {}
+        self._hits_generation += 1
+        if pattern is None:
+            return
+
+        self._update_trigrams()
+        pool = self._get_pool()
+
+        candidates = {}
+        literal = logsearch.literal_of(pattern)
+        if self._trigrams is not None and literal is not None:
+            candidates = self._trigrams.candidates(literal)
+
+        for path, tree_iter in self._files.values():
+            future = pool.submit(logsearch.count_matches, path, pattern,
+                                 candidates.get(path))
+            future.add_done_callback(functools.partial(
+                self._count_done_cb, self._hits_generation, path))
+            self._futures.append(future)
+
+        # The logs of unexpanded sessions are listed by the workers.
+        for complete in self._unexpanded.values():
+            prefix = os.path.join(complete, '')
+            in_session = dict((path, blocks)
+                              for path, blocks in candidates.items()
+                              if path.startswith(prefix))
+            future = pool.submit(logsearch.count_directory, complete,
+                                 pattern, in_session)
+            future.add_done_callback(functools.partial(
+                self._count_done_cb, self._hits_generation, None))
+            self._futures.append(future)
+
+    def _clear_hits(self):
+        # Only the rows counted in by the last search have counts.
+        sessions = set()
+        for path in self._hits:
+            logfile = self._logfiles.get(path)
+            if logfile is not None:
+                self._treemodel.set_value(self._files[logfile][1],
+                                          _COL_HITS, -1)
+            sessions.add(self._session_of(path))
+        sessions.discard(None)
+        for session in sessions:
+            self._treemodel.set_value(self._sessions[session], _COL_HITS, -1)
+
+    def _session_of(self, path):
+        directory = os.path.dirname(path)
+        session = os.path.basename(directory)
+        if session in self._sessions and \
+                os.path.dirname(directory) == self.paths[0]:
+            return session
+        return None
+
+    def _count_done_cb(self, generation, path, future):
+        # Called in a thread of the pool.
+        GLib.idle_add(self._add_hits, generation, path, future)
+
+    def _add_hits(self, generation, path, future):
+        # A count for the file at path, or counts for a whole directory
+        # by path.
+        if generation == self._hits_generation and \
+                not future.cancelled() and future.exception() is None:
+            if path is None:
+                for path, hits in future.result().items():
+                    self._set_hits(path, hits)
+            else:
+                self._set_hits(path, future.result())
+        return False
 
-        _buffer = self._textview.get_buffer()
+    def _set_hits(self, path, hits):
+        self._hits[path] = hits
+        logfile = self._logfiles.get(path)
+        if logfile is not None:
+            self._treemodel.set_value(self._files[logfile][1], _COL_HITS,
+                                      hits)
+
+        # Add up the matches in each session directory.
+        session = self._session_of(path)
+        if session is not None:
+            session = self._sessions[session]
+            total = self._treemodel.get_value(session, _COL_HITS)
+            self._treemodel.set_value(session, _COL_HITS,
+                                      max(total, 0) + hits)
+
+    def is_searching(self):
+        log = self.active_log
+        return log is not None and log.searching
 
-        start, end = _buffer.get_bounds()
-        _buffer.remove_tag_by_name('search-hilite', start, end)
-        _buffer.remove_tag_by_name('search-select', start, end)
+    def get_next_result(self, direction):
+        """Return the index of the next match in direction, or None."""
+        log = self.active_log
+        if log is None or log.pattern is None:
+            return None
 
-        text_iter = _buffer.get_start_iter()
+        return log.find_match(direction)
 
-        while True:
-            next_found = text_iter.forward_search(text, 0, None)
-            if next_found is None:
-                break
-            start, end = next_found
-            _buffer.apply_tag_by_name('search-hilite', start, end)
-            text_iter = end
+    def get_search_position(self):
+        """Return the number of the match at or after the cursor and
+        the number of matches found."""
+        log = self.active_log
+        if log is None or log.pattern is None:
+            return 0, 0
 
-        if self.get_next_result('current'):
-            self.search_next('current')
-        elif self.get_next_result('backward'):
-            self.search_next('backward')
+        i = log.find_match('current')
+        if i is None:
+            i = len(log.matches) - 1
+        return i + 1, len(log.matches)
 
-    def get_next_result(self, direction):
-        _buffer = self._textview.get_buffer()
+    def search_next(self, direction):
+        i = self.get_next_result(direction)
+        if i is not None:
+            self._select_match(i)
+
+    def _select_match(self, i):
+        log = self.active_log
+        next_found = log.get_match_iters(i)
+        if next_found is None:
+            return
+
+        start, end = log.get_bounds()
+        log.remove_tag_by_name('search-select', start, end)
+
+        start, end = next_found
+        log.apply_tag_by_name('search-select', start, end)
+
+        log.place_cursor(start)
+        log.select_match(i, start)
+
+        self._textview.scroll_to_iter(start, 0.1, use_align=False,
+                                      xalign=0.5, yalign=0.5)
+        self._textview.scroll_to_iter(end, 0.1, use_align=False,
+                                      xalign=0.5, yalign=0.5)
+        self._highlight_visible()
+
+
+# The line breaks of Gtk.TextBuffer that are not line ends of a log.
+_LINE_BREAKS = re.compile('\r(?!\n)|\u2029')
+_LINE_BREAK_SUBS = {'\r': ' ', '\u2029': '\u204b'}
+
+_ANSI_SGR = re.compile(r'\033\[([\d;]*)m')
+_ANSI_PARTIAL = re.compile(r'\033(\[[\d;]*)?\Z')
+_ANSI_COLORS = ['#000000', '#CC0000', '#4E9A06', '#C4A000',
+                '#3465A4', '#75507B', '#06989A', '#D3D7CF',
+                '#555753', '#EF2929', '#8AE234', '#FCE94F',
+                '#729FCF', '#AD7FA8', '#34E2E2', '#EEEEEC']
+
+
+class AnsiParser:
+    """Splits text into plain text and the spans of it that have an
+    ANSI SGR style, as a (foreground, background, bold) tuple.
+
+    The style carries over from one feed() to the next, and an escape
+    sequence cut off at the end of a chunk is held back until the rest
+    of it arrives.
+    """
+
+    def __init__(self):
+        self.style = None
+        self._pending = ''
+
+    def feed(self, text):
+        """Return the plain text and a list of (start, end, style)."""
+        text = self._pending + text
+        self._pending = ''
+
+        if '\033' not in text:
+            if self.style is None or not text:
+                return text, []
+            return text, [(0, len(text), self.style)]
+
+        partial = _ANSI_PARTIAL.search(text)
+        if partial is not None:
+            self._pending = partial.group()
+            text = text[:partial.start()]
+
+        plain = []
+        spans = []
+        length = 0
+        last = 0
+        for match in _ANSI_SGR.finditer(text):
+            segment = text[last:match.start()]
+            if segment:
+                if self.style is not None:
+                    spans.append((length, length + len(segment), self.style))
+                plain.append(segment)
+                length += len(segment)
+            self._apply(match.group(1))
+            last = match.end()
+
+        segment = text[last:]
+        if segment:
+            if self.style is not None:
+                spans.append((length, length + len(segment), self.style))
+            plain.append(segment)
+
+        return ''.join(plain), spans
+
+    def _apply(self, params):
+        fg, bg, bold = self.style or (None, None, False)
+        codes = [int(code or 0) for code in params.split(';')]
+
+        i = 0
+        while i < len(codes):
+            code = codes[i]
+            if code == 0:
+                fg, bg, bold = None, None, False
+            elif code == 1:
+                bold = True
+            elif code == 22:
+                bold = False
+            elif 30 <= code <= 37:
+                fg = _ANSI_COLORS[code - 30]
+            elif 90 <= code <= 97:
+                fg = _ANSI_COLORS[code - 82]
+            elif code == 39:
+                fg = None
+            elif 40 <= code <= 47:
+                bg = _ANSI_COLORS[code - 40]
+            elif 100 <= code <= 107:
+                bg = _ANSI_COLORS[code - 92]
+            elif code == 49:
+                bg = None
+            elif code in (38, 48) and i + 1 < len(codes):
+                # 256 colour and RGB forms; only the first 16 of the
+                # 256 colours are shown.
+                color = None
+                if codes[i + 1] == 5 and i + 2 < len(codes):
+                    if codes[i + 2] < 16:
+                        color = _ANSI_COLORS[codes[i + 2]]
+                    i += 2
+                elif codes[i + 1] == 2 and i + 4 < len(codes):
+                    color = '#%02X%02X%02X' % tuple(
+                        min(c, 255) for c in codes[i + 2:i + 5])
+                    i += 4
+                if code == 38:
+                    fg = color
+                else:
+                    bg = color
+            i += 1
 
-        if direction == 'forward':
-            text_iter = _buffer.get_iter_at_mark(_buffer.get_insert())
-            text_iter.forward_char()
+        if fg is None and bg is None and not bold:
+            self.style = None
         else:
-            text_iter = _buffer.get_iter_at_mark(_buffer.get_insert())
+            self.style = (fg, bg, bold)
 
-        if direction == 'backward':
-            return text_iter.backward_search(self.search_text, 0, None)
-        else:
-            return text_iter.forward_search(self.search_text, 0, None)
 
-    def search_next(self, direction):
-        next_found = self.get_next_result(direction)
-        if next_found:
-            _buffer = self._textview.get_buffer()
+class LogWorker(threading.Thread):
+    """A thread working on log files away from the main loop.
+
+    Jobs are queued with _add() and done one at a time by _work().  The
+    results are handed back through an idle callback that applies them
+    to their LogBuffers for at most _FRAME_BUDGET seconds at a time, so
+    the UI keeps drawing while a large log is worked through.
+    """
+
+    def __init__(self, callback):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self._callback = callback
+        self._jobs = queue.Queue()
+        self._chunks = queue.Queue(_QUEUED_CHUNKS)
+        self._lock = threading.Lock()
+        self._idle_id = None
+        self.start()
 
-            start, end = _buffer.get_bounds()
-            _buffer.remove_tag_by_name('search-select', start, end)
+    def _add(self, *job):
+        self._jobs.put(job)
 
-            start, end = next_found
-            _buffer.apply_tag_by_name('search-select', start, end)
+    def _put(self, log, generation, kind, *args):
+        self._chunks.put((log, generation, kind, args))
+        with self._lock:
+            if self._idle_id is None:
+                self._idle_id = GLib.idle_add(self._idle_cb)
 
-            _buffer.place_cursor(start)
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                self._work(*job)
+            except (OSError, ValueError):
+                # The file was closed under us, the job is stale.
+                pass
+            except Exception:
+                # Keep the thread for the jobs of the other logs.
+                logging.exception('Error working on %s', job[0].logfile)
+
+    def _work(self, *job):
+        raise NotImplementedError
+
+    def _idle_cb(self):
+        try:
+            return self._apply_chunks()
+        except Exception:
+            logging.exception('Error applying log chunks')
+            # This source ends here; make sure the chunks still queued
+            # get another one, or the worker blocks on the full queue.
+            with self._lock:
+                self._idle_id = None
+                if not self._chunks.empty():
+                    self._idle_id = GLib.idle_add(self._idle_cb)
+            return False
 
-            self._textview.scroll_to_iter(start, 0.1, use_align=False,
-                                          xalign=0.5, yalign=0.5)
-            self._textview.scroll_to_iter(end, 0.1, use_align=False,
-                                          xalign=0.5, yalign=0.5)
+    def _apply_chunks(self):
+        written = {}
+        deadline = time.time() + _FRAME_BUDGET
+        while time.time() < deadline:
+            try:
+                log, generation, kind, args = self._chunks.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._chunks.empty():
+                        self._idle_id = None
+                        break
+                continue
+            try:
+                count = log.apply(generation, kind, *args)
+            except Exception:
+                logging.exception('Error applying %s to %s', kind,
+                                  log.logfile)
+                log.restart()
+                continue
+            if count is not None:
+                written[log] = written.get(log, 0) + count
+
+        for log in written:
+            self._callback(log, written[log])
+
+        return self._idle_id is not None
+
+
+class LogReader(LogWorker):
+    """Reads log files for LogBuffers.
+
+    LogBuffers ask for a range of their file with read().  The range is
+    read in _CHUNK_SIZE pieces, so a large log streams in.
+    """
+
+    def read(self, log, start, data_from, end, reload):
+        """Index the file of log from start to data_from and pass on
+        the data from there to end.  With reload, the data starts at
+        the next line and replaces the contents of the buffer."""
+        self._add(log, log.generation, log.get_file(),
+                  start, data_from, end, reload)
+
+    def _work(self, log, generation, f, start, data_from, end, reload):
+        fd = f.fileno()
+        offset = start
+
+        part = LineIndex(offset, fragment=True)
+        while offset < data_from:
+            if log.generation != generation:
+                return
+            data = os.pread(fd, min(_CHUNK_SIZE, data_from - offset), offset)
+            if not data:
+                return
+            part.feed(data)
+            offset += len(data)
+            if part.size - part.base >= _WINDOW_SIZE:
+                self._put(log, generation, 'index', part)
+                part = LineIndex(offset, fragment=True)
+
+        if reload:
+            # Start the window at a line.
+            data = os.pread(fd, _CHUNK_SIZE, offset)
+            found = data.find(b'\n')
+            if found > -1:
+                part.feed(data[:found + 1])
+                offset += found + 1
+        if part.size > part.base:
+            self._put(log, generation, 'index', part)
+        if reload:
+            self._put(log, generation, 'reload', offset)
+
+        while offset < end:
+            if log.generation != generation:
+                return
+            data = os.pread(fd, min(_CHUNK_SIZE, end - offset), offset)
+            if not data:
+                return
+            self._put(log, generation, 'data', offset, data)
+            offset += len(data)
+
+
+class LogSearcher(LogWorker):
+    """Searches log files for LogBuffers.
+
+    The matches are passed on as each block of the file is searched.
+    A search stops as soon as its LogBuffer starts another one.  Only
+    the blocks that a TrigramIndex finds may match a literal are read.
+    """
+
+    def __init__(self, callback, trigrams=None):
+        LogWorker.__init__(self, callback)
+        self._trigrams = trigrams
+
+    def search(self, log, start, end):
+        """Search the file of log from start to end for its pattern."""
+        self._add(log, log.search_generation, log.get_file(), log.pattern,
+                  start, end)
+
+    def _work(self, log, generation, f, pattern, start, end):
+        ranges = None
+        literal = logsearch.literal_of(pattern)
+        if self._trigrams is not None and literal is not None:
+            ranges = self._trigrams.ranges(log.logfile, literal, start, end)
+        if ranges is None:
+            ranges = [(start, end)]
+
+        for range_start, range_end in ranges:
+            for offsets, lengths in logsearch.search_file(
+                    f.fileno(), pattern, range_start, range_end):
+                if log.search_generation != generation:
+                    return
+                if len(offsets):
+                    self._put(log, generation, 'matches', offsets, lengths)
+        self._put(log, generation, 'searched', end)
 
 
 class LogBuffer(Gtk.TextBuffer):
+    """A window of a log file.
 
-    def __init__(self, logfile, iterator):
+    Only the bytes between _start and _pos of the file are held in the
+    buffer.  While the window reaches the end of the file, new data
+    read by the LogReader is appended as the file grows and the oldest
+    lines are dropped to keep the window at about _WINDOW_SIZE;
+    page_backward() and page_forward() move the window when the user
+    scrolls away from the tail.  A LineIndex of the whole file locates
+    lines outside of the window.
+
+    Searches run over the whole file in the LogSearcher, and the
+    matches are kept at their offsets in the file.
+
+    The file is kept open between updates.  When it is truncated or
+    replaced, as log rotation does, the buffer starts over with what
+    the file holds now.
+    """
+
+    def __init__(self, logfile, iterator, reader, searcher):
         GObject.GObject.__init__(self)
 
         _tagtable = self.get_tag_table()
@@ -415,34 +1328,689 @@ class LogBuffer(Gtk.TextBuffer):
         select_tag = Gtk.TextTag.new('search-select')
         select_tag.props.background = '#B0B0FF'
         _tagtable.add(select_tag)
+        filter_tag = Gtk.TextTag.new('filtered')
+        filter_tag.props.invisible = True
+        _tagtable.add(filter_tag)
 
         self.logfile = logfile
+        self._reader = reader
+        self._searcher = searcher
+        self._file = None
+        self._inode = None
+        self._start = 0
         self._pos = 0
+        self._following = True
+        self._decoder = _new_decoder()
+        self._ansi = AnsiParser()
+        self._style_tags = {}
+        self.index = LineIndex()
+        # Lines below this level are hidden.
+        self.level = 0
+        self.pattern = None
+        self.matches = MatchIndex()
+        # Whether a search job is in flight, and how far the file has
+        # been searched.
+        self.searching = False
+        self._searched = 0
+        # The range of the buffer in which matches are highlighted.
+        self._hilite_start = self.create_mark(None, self.get_start_iter(),
+                                              True)
+        self._hilite_end = self.create_mark(None, self.get_start_iter(),
+                                            False)
+        # The match last selected, and where.
+        self._selected = None
+        self._selected_mark = self.create_mark(None, self.get_start_iter(),
+                                               False)
+        # Bumped whenever reads or searches in flight no longer apply.
+        self.generation = 0
+        self.search_generation = 0
+        # The bytes of the file asked of the reader so far, and where
+        # the current load started.
+        self._requested = 0
+        self._load_from = 0
+        # Where the bytes compared by _rewritten() are, and what they were.
+        self._sample = None
         self.iter = iterator
         self.update()
 
     def append_formatted_text(self, text):
-        # Remove ANSI escape codes.
-        # todo- Handle a subset of them.
-        strip_ansi = re.compile(r'\033\[[\d;]*m')
-        text = strip_ansi.sub('', text)
-        self.insert(self.get_end_iter(), text)
+        self.insert_formatted_text(self.get_end_iter(), text)
+
+    def insert_formatted_text(self, text_iter, text, parser=None):
+        # Insert the text without its ANSI escape codes in one go, then
+        # apply the styles they set.
+        if parser is None:
+            parser = self._ansi
+        text, spans = parser.feed(text)
+        text = _single_lines(text)
+        offset = text_iter.get_offset()
+        self.insert(text_iter, text)
+        for start, end, style in spans:
+            self.apply_tag(self._get_style_tag(style),
+                           self.get_iter_at_offset(offset + start),
+                           self.get_iter_at_offset(offset + end))
+
+    def _get_style_tag(self, style):
+        tag = self._style_tags.get(style)
+        if tag is None:
+            fg, bg, bold = style
+            tag = Gtk.TextTag()
+            if fg is not None:
+                tag.props.foreground = fg
+            if bg is not None:
+                tag.props.background = bg
+            if bold:
+                tag.props.weight = Pango.Weight.BOLD
+            self.get_tag_table().add(tag)
+            # Below the search tags.
+            tag.set_priority(0)
+            self._style_tags[style] = tag
+        return tag
+
+    def _open(self):
+        self._file = open(self.logfile, 'rb')
+        info = os.fstat(self._file.fileno())
+        self._inode = (info.st_dev, info.st_ino)
+
+    def get_file(self):
+        return self._file
+
+    def close(self):
+        self.generation += 1
+        self.search_generation += 1
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _check_file(self):
+        """Return the size of the file, reopening it first if it has
+        been replaced and starting over if it has been truncated."""
+        if self._file is None:
+            self._open()
+        else:
+            try:
+                info = os.stat(self.logfile)
+            except OSError:
+                # Removed; keep reading what is left through the handle.
+                info = None
+            if info is not None and \
+                    (info.st_dev, info.st_ino) != self._inode:
+                # Rotated, continue with the new file.
+                self.close()
+                self._open()
+                self._restart()
+
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self._requested or self._rewritten():
+            # Truncated in place, maybe grown again since.
+            self._restart()
+        return size
+
+    def _rewritten(self):
+        if self._sample is None:
+            return False
+        offset, data = self._sample
+        return self._read(offset, len(data)) != data
+
+    def _take_sample(self, size):
+        offset = 0
+        if self.index.size:
+            offset = self._last_line_start(self.index.size)
+        self._sample = (offset, self._read(offset,
+                                           min(_SAMPLE_SIZE, size - offset)))
+
+    def restart(self):
+        """Start over with what the file holds now."""
+        self._restart()
+        self.update()
 
-    def update(self):
+    def _restart(self):
+        self.generation += 1
+        self.index.clear()
+        self._reload(0)
+        self._following = True
+        self._requested = self._load_from = 0
+        self._sample = None
+        self.set_search(self.pattern)
+
+    def _read(self, offset, size):
+        if self._file is None:
+            self._open()
+        return os.pread(self._file.fileno(), size, offset)
+
+    def _last_line_start(self, offset):
+        return self.index.offset_of(self.index.line_at(offset))
+
+    def _first_line_start(self, offset):
+        start = self.index.line_start(offset)
+        if start is None:
+            # Inside a line running to the end of the file.
+            return offset
+        return start
+
+    def _append(self, data):
+        # The last line may end up with another level.
+        last = self.get_line_count() - 1
+        self.remove_tag_by_name('filtered', self.get_iter_at_line(last),
+                                self.get_end_iter())
+        self.append_formatted_text(self._decoder.decode(data))
+        self._pos += len(data)
+        self._filter_lines(last, self.get_line_count())
+
+        if self._pos - self._start > _WINDOW_SIZE:
+            # Drop whole lines from the head of the window.
+            cut = self._first_line_start(self._pos - _WINDOW_SIZE)
+            if cut < self._pos:
+                lines = self.index.line_at(cut) - \
+                    self.index.line_at(self._start)
+                self.delete(self.get_start_iter(),
+                            self.get_iter_at_line(lines))
+                self._start = cut
+
+    def set_level(self, level):
+        """Hide the lines of the log below level, or none if it is 0.
+        Lines of no known level are always shown."""
+        self.level = level
+        start, end = self.get_bounds()
+        self.remove_tag_by_name('filtered', start, end)
+        self._filter_lines(0, self.get_line_count())
+
+    def _filter_lines(self, first, end):
+        # Hide the lines of the buffer from first to end that are below
+        # the level, a run of them at a time.
+        if not self.level:
+            return
+        base = self.index.line_at(self._start)
+        hidden = self.index.levels[base + first:base + end].translate(
+            _HIDDEN_LEVELS[self.level])
+        run = hidden.find(1)
+        while run > -1:
+            shown = hidden.find(0, run)
+            if shown == -1:
+                shown = len(hidden)
+            self.apply_tag_by_name('filtered',
+                                   self.get_iter_at_line(first + run),
+                                   self.get_iter_at_line(first + shown))
+            run = hidden.find(1, shown)
+
+    def set_search(self, pattern):
+        """Search the file for a compiled logsearch pattern, or stop
+        searching if it is None."""
+        self.pattern = pattern
+        self.search_generation += 1
+        self.matches = MatchIndex()
+        self.searching = False
+        self._searched = 0
+        self._selected = None
+        self.highlight_matches(0, 0)
+        self._search_more()
+
+    def _search_more(self):
+        # Search what has been indexed since the last search, from the
+        # start of the line it ended in.
+        if self.pattern is None or self.searching or self._file is None or \
+                self._searched >= self.index.size:
+            return
+        self.searching = True
+        self._searcher.search(self, self._last_line_start(self._searched),
+                              self.index.size)
+
+    def highlight_matches(self, first, last):
+        """Highlight the matches on the lines of the buffer from first
+        to last, and no others."""
+        self.remove_tag_by_name('search-hilite',
+                                self.get_iter_at_mark(self._hilite_start),
+                                self.get_iter_at_mark(self._hilite_end))
+
+        end = self.get_iter_at_line(last)
+        if not end.ends_line():
+            end.forward_to_line_end()
+        self.move_mark(self._hilite_start, self.get_iter_at_line(first))
+        self.move_mark(self._hilite_end, end)
+
+        # The same lines in the file.
+        base = self.index.line_at(self._start)
+        first = min(first + base, len(self.index) - 1)
+        start = max(self.index.offset_of(first), self._start)
+        end = self._pos
+        if last + base + 1 < len(self.index):
+            end = min(self.index.offset_of(last + base + 1), end)
+
+        i = self.matches.index_from(start)
+        if i is None or self.matches[i][0] >= end:
+            return
         try:
-            f = open(self.logfile, 'r')
-            init_pos = self._pos
+            data = self._read(start, end - start)
+        except (IOError, OSError):
+            return
 
-            f.seek(self._pos)
-            self.append_formatted_text(f.read())
-            self._pos = f.tell()
-            f.close()
+        while i < len(self.matches):
+            offset, length = self.matches[i]
+            if offset >= end:
+                break
+            match_start, match_end = self._match_iters(offset, length,
+                                                       start, data)
+            self.apply_tag_by_name('search-hilite', match_start, match_end)
+            i += 1
+
+    def _match_iters(self, offset, length, data_start, data):
+        # Iters at the ends of a match in the window, from the bytes of
+        # the file around it.
+        line = self.index.line_at(offset)
+        line_start = max(self.index.offset_of(line), self._start, data_start)
+        line -= self.index.line_at(self._start)
+        column = _shown_length(data[line_start - data_start:
+                                    offset - data_start])
+        width = _shown_length(data[offset - data_start:
+                                   offset + length - data_start])
+        return (self._iter_at_column(line, column),
+                self._iter_at_column(line, column + width))
+
+    def _iter_at_column(self, line, column):
+        text_iter = self.get_iter_at_line(line)
+        end = text_iter.copy()
+        if not end.ends_line():
+            end.forward_to_line_end()
+        text_iter.set_line_offset(min(column, end.get_line_offset()))
+        return text_iter
+
+    def _file_offset_at(self, text_iter):
+        # The offset in the file of an iter, leaving out the escape
+        # codes of the line before it.
+        line_start = text_iter.copy()
+        line_start.set_line_offset(0)
+        line = min(text_iter.get_line() + self.index.line_at(self._start),
+                   len(self.index) - 1)
+        prefix = self.get_text(line_start, text_iter, True)
+        return max(self.index.offset_of(line), self._start) + \
+            len(prefix.encode('utf-8'))
+
+    def find_match(self, direction):
+        """Return the index of the match at the cursor ('current'), or
+        the one after it ('forward') or before it ('backward'), or None
+        if there is none."""
+        cursor = self.get_iter_at_mark(self.get_insert())
+        if self._selected is not None and \
+                cursor.equal(self.get_iter_at_mark(self._selected_mark)):
+            i = self._selected
+            if direction == 'forward':
+                i += 1
+            elif direction == 'backward':
+                i -= 1
+            if 0 <= i < len(self.matches):
+                return i
+            return None
+
+        offset = self._file_offset_at(cursor)
+        if direction == 'backward':
+            return self.matches.index_before(offset)
+        elif direction == 'forward':
+            return self.matches.index_from(offset + 1)
+        return self.matches.index_from(offset)
+
+    def get_match_iters(self, i):
+        """Return iters at the ends of a match, moving the window to it
+        first if needed, or None if the file can not be read."""
+        offset, length = self.matches[i]
+        self.get_iter_at_file_line(self.index.line_at(offset))
+        start = max(self._last_line_start(offset), self._start)
+        try:
+            data = self._read(start, offset + length - start)
+        except (IOError, OSError):
+            return None
+        return self._match_iters(offset, length, start, data)
+
+    def select_match(self, i, text_iter):
+        """Remember that match i is selected, with the cursor at
+        text_iter."""
+        self._selected = i
+        self.move_mark(self._selected_mark, text_iter)
+
+    def _reload(self, offset):
+        self._selected = None
+        self.set_text('')
+        self._decoder = _new_decoder()
+        self._ansi = AnsiParser()
+        self._start = self._pos = offset
+
+    def apply(self, generation, kind, *args):
+        """Apply a piece of work handed over by the LogReader or the
+        LogSearcher and return the number of bytes added to the window,
+        or None if the work no longer applies."""
+        if kind == 'matches':
+            if generation != self.search_generation:
+                return None
+            self.matches.extend(*args)
+            return 0
+        elif kind == 'searched':
+            if generation != self.search_generation:
+                return None
+            self.searching = False
+            self._searched = args[0]
+            self._search_more()
+            return 0
+
+        if generation != self.generation:
+            return None
+        written = 0
+        if kind == 'index':
+            self.index.extend(args[0])
+        elif kind == 'reload':
+            if self._following:
+                self._reload(args[0])
+        elif kind == 'data':
+            offset, data = args
+            if offset > self.index.size:
+                # Data past a gap in the index, after a short read.
+                self.restart()
+                return None
+            if offset + len(data) > self.index.size:
+                self.index.feed(data[self.index.size - offset:])
+            if self._following and offset == self._pos:
+                self._append(data)
+                written = len(data)
+        self._search_more()
+        return written
+
+    def get_progress(self):
+        """Return how much of the current load is done, in percent."""
+        if self._requested == self._load_from:
+            return 100
+        return 100 * (self.index.size - self._load_from) // \
+            (self._requested - self._load_from)
 
-            self._written = (self._pos - init_pos)
+    def update(self):
+        try:
+            size = self._check_file()
         except BaseException:
             self.insert(self.get_end_iter(),
                         _("Error: Can't open file '%s'\n") % self.logfile)
-            self._written = 0
+            return
+
+        start = self._requested
+        if size <= start:
+            return
+        if self.index.size == start:
+            self._load_from = start
+
+        if not self._following:
+            # Only index, the data is paged in when scrolled to.
+            self._reader.read(self, start, size, size, False)
+        elif size - start > _WINDOW_SIZE:
+            # Too much to catch up with, show only the tail.
+            self._reader.read(self, start, size - _WINDOW_SIZE, size, True)
+        else:
+            self._reader.read(self, start, start, size, False)
+        self._requested = size
+        self._take_sample(size)
+
+    def page_backward(self):
+        """Extend the window towards the start of the file.
+
+        Returns True if any text was added.
+        """
+        if self._start == 0:
+            return False
+
+        offset = self._first_line_start(max(0, self._start - _PAGE_SIZE))
+        if offset == self._start:
+            # A single line longer than a page.
+            offset = max(0, self._start - _PAGE_SIZE)
+
+        try:
+            data = self._read(offset, self._start - offset)
+        except (IOError, OSError):
+            return False
+
+        self.insert_formatted_text(self.get_start_iter(),
+                                   data.decode('utf-8', 'replace'),
+                                   AnsiParser())
+        lines = self.index.line_at(self._start) - self.index.line_at(offset)
+        self._start = offset
+        self._filter_lines(0, lines)
+
+        if self._pos - self._start > _WINDOW_SIZE:
+            # Drop whole lines from the tail and stop following it.
+            cut = self._last_line_start(self._start + _WINDOW_SIZE)
+            if cut > self._start:
+                lines = self.index.line_at(cut) - \
+                    self.index.line_at(self._start)
+                self.delete(self.get_iter_at_line(lines), self.get_end_iter())
+                self._decoder = _new_decoder()
+                self._ansi = AnsiParser()
+                self._pos = cut
+                self._following = False
+
+        return True
+
+    def page_forward(self):
+        """Extend the window towards the end of the file, following
+        the file again once its end is reached.
+
+        Returns True if any text was added.
+        """
+        if self._following:
+            return False
+
+        end = self._pos + _PAGE_SIZE
+        if end < self.index.size:
+            end = max(self._last_line_start(end), self._pos + 1)
+        else:
+            end = self.index.size
+            # Follow the file again unless reads are still in flight.
+            self._following = end == self._requested
+
+        try:
+            data = self._read(self._pos, end - self._pos)
+        except (IOError, OSError):
+            return False
+
+        self._append(data)
+        return len(data) > 0
+
+    def get_file_line(self, text_iter):
+        """Return the line of the file an iter is on."""
+        return text_iter.get_line() + self.index.line_at(self._start)
+
+    def get_iter_at_file_line(self, line):
+        """Return an iter at the start of a line of the file, moving
+        the window to it first if needed."""
+        line = max(0, min(line, len(self.index) - 1))
+        offset = self.index.offset_of(line)
+        if not self._start <= offset <= self._pos:
+            start = self._first_line_start(max(0, offset - _WINDOW_SIZE // 2))
+            end = min(start + _WINDOW_SIZE, self.index.size)
+            if end < self.index.size:
+                end = max(self._last_line_start(end), offset)
+            self._reload(start)
+            self._following = end == self.index.size == self._requested
+            try:
+                self._append(self._read(start, end - start))
+            except (IOError, OSError):
+                pass
+
+        return self.get_iter_at_line(line - self.index.line_at(self._start))
+
+
+# For each level filtered on, a table mapping the levels of lines to 1
+# for those hidden.
+_HIDDEN_LEVELS = [bytes(1 if 0 < level < shown else 0 for level in range(256))
+                  for shown in range(logindex.CRITICAL + 1)]
+
+
+class MergeSource:
+    """A log file read for a MergedBuffer, from where it was last read
+    to its end."""
+
+    def __init__(self, name, path, tag):
+        self.name = name
+        self.path = path
+        self.tag = tag
+        self._file = None
+        self._pos = None
+        # The time of the last line with one.
+        self._time = 0
+        self._ansi = AnsiParser()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def records(self, index, start):
+        """Return an iterator of ((time, index), text) for each new line
+        of the file, the first time starting with a line at or after
+        start bytes from the end.  Lines without a time take that of
+        the line before them, so they stay with it."""
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        fd = self._file.fileno()
+        size = os.fstat(fd).st_size
+        if self._pos is None or size < self._pos:
+            self._pos = max(0, size - start)
+            if self._pos > 0:
+                found = os.pread(fd, _CHUNK_SIZE, self._pos - 1).find(b'\n')
+                self._pos = self._pos + found if found > -1 else size
+        return self._records(index, fd, size)
+
+    def _records(self, index, fd, size):
+        rest = b''
+        while self._pos + len(rest) < size:
+            offset = self._pos + len(rest)
+            data = rest + os.pread(fd, min(_CHUNK_SIZE, size - offset), offset)
+            lines = data.split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                self._pos += len(line) + 1
+                when = logindex.parse_time(line)
+                if when is not None:
+                    self._time = when
+                text = self._ansi.feed(line.decode('utf-8', 'replace'))[0]
+                yield (self._time, index), text
+
+
+class MergedBuffer(Gtk.TextBuffer):
+    """Several log files merged into one view by the times of their
+    lines.
+
+    update() merges the lines added to the files since the last update
+    with heapq.merge(), which reads each file only as far as it needs
+    to, in an idle callback working for _FRAME_BUDGET seconds at a
+    time.  Each line is shown with the name of its file and the
+    background of the file.  Lines added later than lines of other
+    files already shown are added at the end.
+    """
+
+    def __init__(self, sources):
+        GObject.GObject.__init__(self)
+
+        self._sources = []
+        for i, (name, path) in enumerate(sources):
+            tag = Gtk.TextTag()
+            tag.props.paragraph_background = \
+                _MERGE_COLORS[i % len(_MERGE_COLORS)]
+            self.get_tag_table().add(tag)
+            self._sources.append(MergeSource(name, path, tag))
+
+        self._merge = None
+        self._pending = False
+        self._idle_id = None
+        self.update()
+
+    def close(self):
+        if self._idle_id is not None:
+            GLib.source_remove(self._idle_id)
+            self._idle_id = None
+        self._merge = None
+        for source in self._sources:
+            source.close()
+
+    def update(self):
+        """Merge in the lines added to the files."""
+        if self._merge is not None:
+            # Once the merge going on is done.
+            self._pending = True
+            return
+
+        records = []
+        start = _WINDOW_SIZE // len(self._sources)
+        for i, source in enumerate(self._sources):
+            try:
+                records.append(source.records(i, start))
+            except (IOError, OSError):
+                logging.debug(_("ERROR: Unable to read file '%(file)s'.") %
+                              {'file': source.path})
+        self._merge = heapq.merge(*records)
+        if self._idle_id is None:
+            self._idle_id = GLib.idle_add(self._merge_cb)
+
+    def _merge_cb(self):
+        records = []
+        deadline = time.time() + _FRAME_BUDGET
+        try:
+            for record in self._merge:
+                records.append(record)
+                if len(records) % 100 == 0 and time.time() > deadline:
+                    break
+            else:
+                self._merge = None
+        except (IOError, OSError, ValueError):
+            # A file went away, or was closed under us.
+            self._merge = None
+        self._add_lines(records)
+
+        if self._merge is None and self._pending:
+            self._pending = False
+            self.update()
+        if self._merge is None:
+            self._idle_id = None
+            return False
+        return True
+
+    def _add_lines(self, records):
+        # Insert the lines in one go, then tag each run of lines of the
+        # same file.
+        text = []
+        runs = []
+        offset = self.get_char_count()
+        for (when, i), line in records:
+            line = '%s: %s\n' % (self._sources[i].name, line)
+            if runs and runs[-1][0] == i:
+                runs[-1][2] += len(line)
+            else:
+                runs.append([i, offset, offset + len(line)])
+            text.append(line)
+            offset += len(line)
+
+        self.insert(self.get_end_iter(), ''.join(text))
+        for i, start, end in runs:
+            self.apply_tag(self._sources[i].tag,
+                           self.get_iter_at_offset(start),
+                           self.get_iter_at_offset(end))
+
+        excess = self.get_char_count() - _WINDOW_SIZE
+        if excess > 0:
+            cut = self.get_iter_at_offset(excess)
+            if not cut.starts_line():
+                cut.forward_line()
+            self.delete(self.get_start_iter(), cut)
+
+
+def _new_decoder():
+    return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+def _single_lines(text):
+    # Gtk.TextBuffer also breaks lines at a lone '\r' and at U+2029,
+    # which would put its lines out of step with the LineIndex.  The
+    # replacements keep the length and the UTF-8 size of the text.
+    return _LINE_BREAKS.sub(lambda match: _LINE_BREAK_SUBS[match.group()],
+                            text)
+
+
+def _shown_length(data):
+    # The length of bytes of a log as text in a LogBuffer.
+    return len(AnsiParser().feed(data.decode('utf-8', 'replace'))[0])
 
 
 class LogActivity(activity.Activity):
@@ -460,7 +2028,10 @@ class LogActivity(activity.Activity):
         ext_files = []
         ext_files.append(os.path.expanduser('~/.bash_history'))
 
-        self.viewer = MultiLogView(paths, ext_files)
+        index_path = os.path.join(activity.get_activity_root(), 'data',
+                                  'trigrams.pickle')
+        self.viewer = MultiLogView(paths, ext_files, index_path)
+        self.viewer.connect('search-changed', self._search_changed_cb)
         self.set_canvas(self.viewer)
         self.viewer.grab_focus()
 
@@ -509,6 +2080,28 @@ class LogActivity(activity.Activity):
         wrap_btn.connect('clicked', self._wrap_cb)
         self._toolbar.insert(wrap_btn, -1)
 
+        self._level_combo = Gtk.ComboBoxText()
+        for level, name in [(0, _('All levels')),
+                            (logindex.INFO, _('Info')),
+                            (logindex.WARNING, _('Warnings')),
+                            (logindex.ERROR, _('Errors')),
+                            (logindex.CRITICAL, _('Critical'))]:
+            self._level_combo.append(str(level), name)
+        self._level_combo.set_active(0)
+        self._level_combo.connect('changed', self._level_changed_cb)
+        level_item = Gtk.ToolItem()
+        level_item.add(self._level_combo)
+        self._toolbar.insert(level_item, -1)
+
+        time_entry = Gtk.Entry()
+        time_entry.set_placeholder_text(_('hh:mm:ss'))
+        time_entry.set_tooltip_text(_('Go to time'))
+        time_entry.set_width_chars(8)
+        time_entry.connect('activate', self._time_entry_activate_cb)
+        time_item = Gtk.ToolItem()
+        time_item.add(time_entry)
+        self._toolbar.insert(time_item, -1)
+
         self.search_entry = iconentry.IconEntry()
         self.search_entry.set_size_request(Gdk.Screen.width() / 3, -1)
         self.search_entry.set_icon_from_name(
@@ -530,6 +2123,26 @@ class LogActivity(activity.Activity):
         self._search_next.connect('clicked', self._search_next_cb)
         self._toolbar.insert(self._search_next, -1)
 
+        self._search_count = Gtk.Label()
+        self._search_count_item = Gtk.ToolItem()
+        self._search_count_item.add(self._search_count)
+        self._toolbar.insert(self._search_count_item, -1)
+
+        self._search_regex = Gtk.CheckButton(label=_('Regex'))
+        self._search_regex.connect('toggled', self._search_option_toggled_cb)
+        self._search_case = Gtk.CheckButton(label=_('Match case'))
+        self._search_case.set_active(True)
+        self._search_case.connect('toggled', self._search_option_toggled_cb)
+        self._search_all = Gtk.CheckButton(label=_('All logs'))
+        self._search_all.connect('toggled', self._search_option_toggled_cb)
+        hbox = Gtk.HBox(False, 5)
+        hbox.pack_start(self._search_regex, False, False, 0)
+        hbox.pack_start(self._search_case, False, False, 0)
+        hbox.pack_start(self._search_all, False, False, 0)
+        self._search_options_item = Gtk.ToolItem()
+        self._search_options_item.add(hbox)
+        self._toolbar.insert(self._search_options_item, -1)
+
         self._update_search_buttons()
 
         self.collector_palette = CollectorPalette(self)
@@ -578,13 +2191,15 @@ class LogActivity(activity.Activity):
 
     def _remove_controls(self, toolbar):
         for control in [self._search_item, self._search_prev,
-                        self._search_next]:
+                        self._search_next, self._search_count_item,
+                        self._search_options_item]:
             if control in toolbar:
                 toolbar.remove(control)
 
     def _add_controls(self, toolbar):
         for control in [self._search_item, self._search_prev,
-                        self._search_next]:
+                        self._search_next, self._search_count_item,
+                        self._search_options_item]:
             if control not in toolbar:
                 toolbar.insert(control, -1)
                 control.show()
@@ -605,13 +2220,26 @@ class LogActivity(activity.Activity):
         else:
             self.viewer._textview.set_wrap_mode(Gtk.WrapMode.NONE)
 
+    def _time_entry_activate_cb(self, entry):
+        self.viewer.jump_to_time(entry.get_text())
+
+    def _level_changed_cb(self, combo):
+        self.viewer.set_level(int(combo.get_active_id()))
+
     def _search_entry_activate_cb(self, entry):
         if self._autosearch_timer:
             GLib.source_remove(self._autosearch_timer)
             self._autosearch_timer = None
-        self.viewer.set_search_text(entry.props.text)
+        self.viewer.set_search_text(entry.props.text,
+                                    self._search_regex.get_active(),
+                                    self._search_case.get_active(),
+                                    self._search_all.get_active())
         self._update_search_buttons()
 
+    def _search_option_toggled_cb(self, button):
+        if self.search_entry.props.text:
+            self.search_entry.activate()
+
     def _search_entry_changed_cb(self, entry):
         if self._autosearch_timer:
             GLib.source_remove(self._autosearch_timer)
@@ -631,11 +2259,29 @@ class LogActivity(activity.Activity):
         self.viewer.search_next('forward')
         self._update_search_buttons()
 
+    def _search_changed_cb(self, viewer):
+        self._update_search_buttons()
+
     def _update_search_buttons(self,):
         if len(self.viewer.search_text) == 0:
             self._search_prev.props.sensitive = False
             self._search_next.props.sensitive = False
+            self._search_count.set_text('')
+        elif self.viewer.search_error is not None:
+            self._search_prev.props.sensitive = False
+            self._search_next.props.sensitive = False
+            self._search_count.set_text(_('Invalid expression'))
         else:
+            index, count = self.viewer.get_search_position()
+            if count == 0 and self.viewer.is_searching():
+                self._search_count.set_text(_('Searching...'))
+            elif count == 0:
+                self._search_count.set_text(_('No matches'))
+            else:
+                self._search_count.set_text(
+                    _('%(index)d of %(count)d') %
+                    {'index': index, 'count': count})
+
             prev_result = self.viewer.get_next_result('backward')
             next_result = self.viewer.get_next_result('forward')
             self._search_prev.props.sensitive = prev_result is not None
@@ -665,41 +2311,94 @@ class CollectorPalette(Palette):
         self._activity = activity
 
         self._collector = LogCollect()
+        self._capture = None
+        self._cancel = None
 
         trans = _('This captures information about the system\n'
                   'and running processes to a journal entry.\n'
                   'Use this to improve a problem report.')
         label = Gtk.Label(label=trans)
 
-        send_button = Gtk.Button(_('Capture information'))
-        send_button.connect('clicked', self._on_send_button_clicked_cb)
+        self._send_button = Gtk.Button(_('Capture information'))
+        self._send_button.connect('clicked', self._on_send_button_clicked_cb)
+
+        self._progress = Gtk.ProgressBar()
+        self._progress.set_show_text(True)
+        self._progress.set_no_show_all(True)
+
+        self._cancel_button = Gtk.Button(_('Cancel'))
+        self._cancel_button.connect('clicked',
+                                    self._on_cancel_button_clicked_cb)
+        self._cancel_button.set_no_show_all(True)
 
         vbox = Gtk.VBox(False, 5)
         vbox.pack_start(label, True, True, 0)
-        vbox.pack_start(send_button, True, True, 0)
+        vbox.pack_start(self._send_button, True, True, 0)
+        vbox.pack_start(self._progress, True, True, 0)
+        vbox.pack_start(self._cancel_button, True, True, 0)
         vbox.show_all()
 
         self.set_content(vbox)
 
     def _on_send_button_clicked_cb(self, button):
-        window = self._activity.get_window()
-        old_cursor = window.get_cursor()
-        window.set_cursor(Gdk.Cursor.new(Gdk.CursorType.WATCH))
-        Gdk.flush()
+        if self._capture is not None:
+            return
 
         identifier = str(int(time.time()))
         filename = '%s.zip' % identifier
         filepath = os.path.join(activity.get_activity_root(), filename)
-        success = True
-        # FIXME: subprocess or thread
+
+        self._send_button.set_sensitive(False)
+        self._progress.set_fraction(0)
+        self._progress.set_text(_('Starting...'))
+        self._progress.show()
+        self._cancel_button.set_sensitive(True)
+        self._cancel_button.show()
+
+        # The capture runs top and compresses all of the logs, which
+        # takes a while; keep the viewer usable meanwhile.
+        self._cancel = threading.Event()
+        self._capture = threading.Thread(target=self._capture_logs,
+                                         args=(filepath, self._cancel))
+        self._capture.daemon = True
+        self._capture.start()
+
+    def _on_cancel_button_clicked_cb(self, button):
+        if self._cancel is not None:
+            self._cancel.set()
+            self._cancel_button.set_sensitive(False)
+            self._progress.set_text(_('Cancelling...'))
+
+    def _capture_logs(self, filepath, cancel):
+        def progress(step, steps, name):
+            GLib.idle_add(self._progress_cb, cancel, step, steps, name)
+
         try:
-            self._collector.write_logs(archive=filepath, logbytes=0)
+            archive = self._collector.write_logs(
+                archive=filepath, logbytes=0, progress=progress,
+                cancel=cancel)
+            success = True
         except BaseException:
+            archive = None
             success = False
+        GLib.idle_add(self._capture_done_cb, archive, success)
 
-        self.popdown(True)
+    def _progress_cb(self, cancel, step, steps, name):
+        if cancel is self._cancel and not cancel.is_set():
+            self._progress.set_fraction(float(step) / steps)
+            self._progress.set_text(name)
+        return False
+
+    def _capture_done_cb(self, archive, success):
+        self._capture = None
+        self._cancel = None
+        self._send_button.set_sensitive(True)
+        self._progress.hide()
+        self._cancel_button.hide()
 
         if not success:
+            self.popdown(True)
+
             title = _('Logs not captured')
             msg = _('The logs could not be captured.')
 
@@ -708,7 +2407,15 @@ class CollectorPalette(Palette):
             notify.props.msg = msg
             notify.connect('response', _notify_response_cb, self._activity)
             self._activity.add_alert(notify)
+            return False
 
+        if archive is None:
+            # Cancelled.
+            return False
+
+        self.popdown(True)
+
+        filename = os.path.basename(archive)
         jobject = datastore.create()
         metadata = {
             'title': _('log-%s') % filename,
@@ -718,12 +2425,10 @@ class CollectorPalette(Palette):
         }
         for k, v in list(metadata.items()):
             jobject.metadata[k] = v
-        jobject.file_path = filepath
+        jobject.file_path = archive
         datastore.write(jobject)
         self._last_log = jobject.object_id
         jobject.destroy()
         activity.show_object_in_journal(self._last_log)
-        os.remove(filepath)
-
-        window.set_cursor(old_cursor)
-        Gdk.flush()
+        os.remove(archive)
+        return False